@@ -4,13 +4,17 @@
 from PyQt5 import QtGui, QtCore, QtWidgets
 from PyQt5.QtCore import Qt
 from PIL import Image
-Image.MAX_IMAGE_PIXELS = 933120000
 import fitz, fpdf
-import os, sys, shutil, io
+import os, sys, shutil
+import hashlib
 import numpy as np
-import itertools
+import itertools, collections
 import datetime
 import pickle, json, glob
+import struct, re, bisect
+import threading, tempfile
+import getpass, socket, time
+import argparse, base64
 import logging
 import traceback
 #import cProfile
@@ -34,18 +38,121 @@ def ExceptionHook(excType, excValue, traceback, logging=logging):
 sys.excepthook = ExceptionHook
 
 
+marksFileName = "marks.dat"
+marksFileMagic = b"PDMK"
+marksFileVersion = 1
+# one record per mark, followed by the (x,y) float32 points of all touch marks on the page
+markRecord = np.dtype([("type","u1"), ("x","<i4"), ("y","<i4"), ("w","<f4"), ("h","<f4"), ("score","<i4"), ("nPos","<u4")])
+noScore = -2**31
+
 class Mark:
+	# mark types
+	STRIKE, SCORE, TALLY, JUSTIFY, CIRCLE, LEFTARROW, RIGHTARROW, TOUCH = range(8)
+	typeNames = ["strike", "score", "tally", "justify", "circle", "leftarrow", "rightarrow", "touch"]
+	__slots__ = ("type", "x", "y", "w", "h", "score", "posList")
+	
 	def __init__(self, type, x, y, w, h, score=None, posList=None):
 		self.type = type
 		self.x = int(x)
 		self.y = int(y)
 		self.h = int(h) 
 		self.w = int(w)
-		self.posList = posList # list of QPointF
+		self.posList = posList # numpy float32 array of (x,y) rows, for touch marks
 		self.score = score
 		
+	def __setstate__(self, state):
+		# marks from legacy marks.pickle files carry their __dict__, with a string type and a list of points
+		type = state["type"]
+		if isinstance(type, str):
+			type = Mark.typeNames.index(type)
+		posList = state.get("posList")
+		if posList is not None:
+			posList = np.array(posList, dtype=np.float32).reshape(-1,2)
+		Mark.__init__(self, type, state["x"], state["y"], state["w"], state["h"], state.get("score"), posList)
+		self.w = state["w"] # may have been resized to non-integer
+		self.h = state["h"]
+		
 	def __repr__(self):
-		return "type:%s x:%s y:%s h:%s w:%s score:%s" % (self.type, self.x, self.y, self.h, self.w, self.score)
+		return "type:%s x:%s y:%s h:%s w:%s score:%s" % (Mark.typeNames[self.type], self.x, self.y, self.h, self.w, self.score)
+
+def ReplaceFile(path, data):
+	# write via a temporary file, so that nobody (including other markers) ever sees a half written file
+	tmp_path = "%s.%s-%d-%d.tmp" % (path, socket.gethostname(), os.getpid(), threading.get_ident())
+	with open(tmp_path, "wb" if isinstance(data, bytes) else "w") as f:
+		f.write(data)
+	os.replace(tmp_path, path)
+
+def GetUserName():
+	# identifies this marker in lease and session files; set PDF_MARKER_USER to run several markers as one login
+	user = os.environ.get("PDF_MARKER_USER") or "%s@%s" % (getpass.getuser(), socket.gethostname())
+	return re.sub(r"[^\w@.-]", "_", user)
+
+def SaveMarksFile(path, marks):
+	chunks = [marksFileMagic, struct.pack("<HI", marksFileVersion, len(marks))]
+	for page in marks:
+		records = np.zeros(len(page), dtype=markRecord)
+		points = []
+		for i in range(len(page)):
+			mark = page[i]
+			records[i] = (mark.type, mark.x, mark.y, mark.w, mark.h, noScore if mark.score is None else mark.score, 
+							0 if mark.posList is None else len(mark.posList))
+			if mark.posList is not None:
+				points.append(np.asarray(mark.posList, dtype="<f4").reshape(-1,2))
+		chunks.append(struct.pack("<I", len(page)))
+		chunks.append(records.tobytes())
+		chunks.extend(p.tobytes() for p in points)
+	ReplaceFile(path, b"".join(chunks))
+
+def LoadMarksFile(path):
+	# the file may come from anywhere, so check every length before trusting it
+	with open(path, "rb") as f:
+		data = f.read()
+	if len(data) < 10 or data[:4] != marksFileMagic:
+		raise ValueError("Not a marks file: %s" % path)
+	version, nPages = struct.unpack_from("<HI", data, 4)
+	if version != marksFileVersion:
+		raise ValueError("Unsupported marks file version %d: %s" % (version, path))
+	offset = 10
+	marks = []
+	for _ in range(nPages):
+		if offset+4 > len(data):
+			raise ValueError("Truncated marks file: %s" % path)
+		nMarks, = struct.unpack_from("<I", data, offset)
+		offset += 4
+		if offset + nMarks*markRecord.itemsize > len(data):
+			raise ValueError("Truncated marks file: %s" % path)
+		records = np.frombuffer(data, dtype=markRecord, count=nMarks, offset=offset)
+		offset += nMarks*markRecord.itemsize
+		nPoints = int(records["nPos"].sum(dtype=np.int64))
+		scored = (records["type"]==Mark.SCORE) | (records["type"]==Mark.TALLY)
+		if (offset + nPoints*8 > len(data) or np.any(records["type"] > Mark.TOUCH) or np.any(records["nPos"][records["type"] != Mark.TOUCH])
+			or np.any(records["score"][scored]==noScore) or not np.all(np.isfinite(records["w"])) or not np.all(np.isfinite(records["h"]))):
+			raise ValueError("Corrupt marks file: %s" % path)
+		points = np.frombuffer(data, dtype="<f4", count=nPoints*2, offset=offset).reshape(-1,2)
+		if not np.all(np.isfinite(points)):
+			raise ValueError("Corrupt marks file: %s" % path)
+		offset += nPoints*8
+		page = []
+		p = 0
+		for type, x, y, w, h, score, nPos in records.tolist():
+			mark = Mark(type, x, y, 0, 0, None if score==noScore else score)
+			mark.w = w
+			mark.h = h
+			if type==Mark.TOUCH:
+				mark.posList = points[p:p+nPos]
+				p += nPos
+			page.append(mark)
+		marks.append(page)
+	return marks
+
+class LegacyMarksUnpickler(pickle.Unpickler):
+	# only allow the classes that legacy marks.pickle files contain
+	def find_class(self, module, name):
+		if name=="Mark" and module in ("__main__", "pdf_marker"):
+			return Mark
+		if name=="QPointF" and module=="PyQt5.QtCore":
+			return lambda x=0.0, y=0.0: (x,y)
+		raise pickle.UnpicklingError("Unexpected class in marks file: %s.%s" % (module, name))
 
 class MarkScheme:
 	def __init__(self, file):
@@ -78,46 +185,110 @@ class MarkScheme:
 		for i in range(len(self.qs_max)):
 			self.fullMarksStr += "Q{:<2}:  {:<2}  {:<20}".format(i+1, np.sum(self.part_qs_max[i]), str(self.part_qs_max[i])) + "\n"
 
+candidateSerials = itertools.count()
+
 class Candidate:
-	def __init__(self, dir):
+	def __init__(self, dir, convert=True):
+		# convert=False reads a legacy marks file without writing it back, for readers off the GUI thread
 		self.dir = dir
 		self.name = os.path.split(dir)[-1]
-		self.LoadMarks()
+		self.LoadMarks(convert)
+		
+	def LoadMarks(self, convert=True):
+		path = os.path.join(self.dir, marksFileName)
+		legacy_path = os.path.join(self.dir, "marks.pickle")
+		if not os.path.exists(path) and os.path.exists(legacy_path):
+			with open(legacy_path, "rb") as f:
+				self.marks = LegacyMarksUnpickler(f).load()
+			if convert:
+				SaveMarksFile(path, self.marks)
+				logging.info("Converted legacy marks file for '%s'" % self.name)
+		else:
+			self.marks = LoadMarksFile(path)
+		for i in range(len(self.marks)):
+			self.marks[i].sort(key=lambda x: x.y) # older marks files were not kept sorted
+		self.pageTally = [0]*len(self.marks) # running tally carried into the top of each page
+		self.serial = next(candidateSerials) # with pageVersions, identifies what is drawn on a page for TileCache
+		self.pageVersions = [0]*len(self.marks) # bumped whenever the marks drawn on a page change
+		self.dirtyPages = None # [first, last] page whose score/tally marks changed since last tally
+		self.collated = None # cached (qs, part_qs)
+		self.InvalidateTally(0, len(self.marks)-1)
 		
-	def LoadMarks(self):
-		with open(os.path.join(self.dir, "marks.pickle"), "rb") as f:
-			self.marks = pickle.load(f)
-	
 	def SaveMarks(self):
-		with open(os.path.join(self.dir, "marks.pickle"), "wb") as f:
-			pickle.dump(self.marks, f)
+		SaveMarksFile(os.path.join(self.dir, marksFileName), self.marks)
+	
+	def InvalidateTally(self, first, last=None):
+		last = first if last is None else last
+		if self.dirtyPages:
+			first = min(first, self.dirtyPages[0])
+			last = max(last, self.dirtyPages[1])
+		self.dirtyPages = [first, last]
+		self.collated = None
+	
+	# all changes to self.marks go through AddMark, RemoveMark and ClearPage, so that pages stay sorted by y
+	def AddMark(self, page, mark):
+		marks = self.marks[page]
+		lo, hi = 0, len(marks)
+		while lo < hi: # insert after any marks with equal y, as a stable sort would
+			mid = (lo+hi)//2
+			if mark.y < marks[mid].y:
+				hi = mid
+			else:
+				lo = mid+1
+		marks.insert(lo, mark)
+		self.pageVersions[page] += 1
+		if mark.type==Mark.SCORE or mark.type==Mark.TALLY:
+			self.InvalidateTally(page)
+	
+	def RemoveMark(self, page, i):
+		mark = self.marks[page].pop(i)
+		self.pageVersions[page] += 1
+		if mark.type==Mark.SCORE or mark.type==Mark.TALLY:
+			self.InvalidateTally(page)
+		return mark
+	
+	def ClearPage(self, page):
+		self.marks[page] = []
+		self.pageVersions[page] += 1
+		self.InvalidateTally(page)
 	
 	def TallyMarks(self):
-		sorted_marks = []
-		for i in range(len(self.marks)):
-			sorted_marks.append(sorted(self.marks[i], key=lambda x: x.y))
-		tally = 0
-		for i in range(len(sorted_marks)):
-			for mark in sorted_marks[i]:
-				if mark.type=="score":
+		# recompute tally boxes from the first changed page onwards, stopping once the carried tally matches what is already there
+		if not self.dirtyPages:
+			return
+		first, last = self.dirtyPages
+		self.dirtyPages = None
+		if len(self.marks)==0:
+			return
+		tally = self.pageTally[first]
+		for i in range(first, len(self.marks)):
+			if i > last and tally == self.pageTally[i]:
+				break
+			self.pageTally[i] = tally
+			for mark in self.marks[i]:
+				if mark.type==Mark.SCORE:
 					tally += mark.score
-				if mark.type=="tally":
-					mark.score = tally
+				if mark.type==Mark.TALLY:
+					if mark.score != tally:
+						mark.score = tally
+						self.pageVersions[i] += 1
 					tally = 0
-		self.marks = sorted_marks
-		
+			
 	def CollateMarks(self):
-		self.TallyMarks() # we need them sorted, might as well tally too
-		qs = []
-		part_qs = [[]]
-		for i in range(len(self.marks)):
-			for mark in self.marks[i]:
-				if mark.type=="score":
-					part_qs[-1].append(mark.score)
-				if mark.type=="tally":
-					qs.append(mark.score)
-					part_qs.append([])
-		return qs, part_qs
+		self.TallyMarks()
+		if self.collated is None:
+			qs = []
+			part_qs = [[]]
+			for i in range(len(self.marks)):
+				for mark in self.marks[i]:
+					if mark.type==Mark.SCORE:
+						part_qs[-1].append(mark.score)
+					if mark.type==Mark.TALLY:
+						qs.append(mark.score)
+						part_qs.append([])
+			self.collated = (qs, part_qs)
+		qs, part_qs = self.collated
+		return list(qs), [list(p) for p in part_qs] # callers are free to modify
 	
 	def CheckMarks(self, ms):
 		qs, part_qs = self.CollateMarks()
@@ -170,7 +341,7 @@ class Candidate:
 		for i in range(len(self.marks)):
 			found_strike = False
 			for mark in self.marks[i]:
-				if mark.type=="strike":
+				if mark.type==Mark.STRIKE:
 					found_strike = True
 					break
 			if not found_strike:
@@ -182,32 +353,1264 @@ class Candidate:
 		return True, score, label_text, "Complete.\n\n"	
 			
 	def GetPagePath(self, i):
-		return os.path.join(self.dir, "%03d"%(i)+".jpg")
+		return GetPagePath(self.dir, i)
 	
 	
-class PrettyWidget(QtWidgets.QWidget):
+def GetPagePath(dir, i):
+	return os.path.join(dir, "%03d"%(i)+".jpg")
+
+def GetMarksTime(dir):
+	path = os.path.join(dir, marksFileName)
+	return os.path.getmtime(path) if os.path.exists(path) else None
+	
+def CandidateStatus(candidate, markScheme):
+	# summary of a candidate used to filter views, safe to compute off the GUI thread
+	qs, _ = candidate.CollateMarks()
+	return {
+		"mtime" : GetMarksTime(candidate.dir),
+		"complete" : bool(markScheme) and candidate.CheckMarks(markScheme)[0],
+		"score" : int(np.sum(qs, dtype=int)),
+		"nMarks" : sum(len(page) for page in candidate.marks),
+		"strokes" : any(mark.type==Mark.TOUCH for page in candidate.marks for mark in page),
+		"nPages" : len(candidate.marks),
+		"unstruck" : [i for i in range(len(candidate.marks)) if not any(mark.type==Mark.STRIKE for mark in candidate.marks[i])],
+		"questions" : QuestionRegions(candidate)
+	}
+	
+def QuestionRegions(candidate):
+	# [startPage, startY, endPage, endY] of each question, as delimited by the tally marks
+	regions = []
+	start_page, start_y = 0, 0
+	for i in range(len(candidate.marks)):
+		for mark in candidate.marks[i]:
+			if mark.type==Mark.TALLY:
+				regions.append([start_page, start_y, i, mark.y])
+				start_page, start_y = i, mark.y
+	return regions
+
+class CandidateLease:
+	# a lock file claiming a candidate for one marker; a lease that is not renewed within timeout seconds can be taken over
+	timeout = 300
+	fileName = "lease.lock"
+	
+	def __init__(self, dir, user):
+		self.dir = dir
+		self.path = os.path.join(dir, self.fileName)
+		self.user = user
+		self.host = socket.gethostname()
+		self.pid = os.getpid()
+		self.held = False
+		
+	@staticmethod
+	def ReadLeaseFile(path):
+		# (lease, seconds since last renewed), or (None, None) if there is no such file; lease is None if it can't be read,
+		# which still expires like any other
+		try:
+			age = time.time() - os.path.getmtime(path)
+		except OSError:
+			return None, None
+		try:
+			with open(path, "r") as f:
+				lease = json.load(f)
+		except (OSError, ValueError):
+			return None, age
+		return (lease if isinstance(lease, dict) and "user" in lease else None), age
+			
+	@classmethod
+	def ReadLease(cls, dir):
+		return cls.ReadLeaseFile(os.path.join(dir, cls.fileName))
+			
+	@classmethod
+	def GetHolder(cls, dir):
+		# current holder, ignoring expired leases
+		lease, age = cls.ReadLease(dir)
+		if age is None or age >= cls.timeout:
+			return None
+		return lease["user"] if lease else "an unknown marker"
+		
+	def IsMine(self, lease):
+		# the same login may run several markers, so a lease belongs to one process rather than to a user
+		return lease is not None and (lease["user"], lease.get("host"), lease.get("pid"))==(self.user, self.host, self.pid)
+		
+	def IsOrphaned(self, lease):
+		# our own lease left behind by a marker on this host that has since exited, e.g. after a crash
+		if lease is None or lease["user"]!=self.user or lease.get("host")!=self.host or not isinstance(lease.get("pid"), int):
+			return False
+		if os.name=="nt": # os.kill would terminate it, leave it to expire instead
+			return False
+		try:
+			os.kill(lease["pid"], 0)
+		except ProcessLookupError:
+			return True
+		except OSError: # alive, but someone else's
+			pass
+		return False
+		
+	def Create(self):
+		# write the lease aside then link it into place, so that it never exists half written; returns False if it exists already
+		data = json.dumps({"user" : self.user, "host" : self.host, "pid" : self.pid, "acquired" : time.time()})
+		tmp_path = "%s.%s-%d.tmp" % (self.path, self.host, self.pid)
+		with open(tmp_path, "w") as f:
+			f.write(data)
+		try:
+			os.link(tmp_path, self.path)
+			return True
+		except FileExistsError:
+			return False
+		except OSError: # no hard links on this file system
+			try:
+				fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+			except FileExistsError:
+				return False
+			with os.fdopen(fd, "w") as f:
+				f.write(data)
+			return True
+		finally:
+			os.remove(tmp_path)
+		
+	def Acquire(self, breakExpired=True):
+		if self.Create():
+			self.held = True
+			return True
+		lease, age = self.ReadLease(self.dir)
+		if age is None: # released in the meantime
+			return self.Acquire(False) if breakExpired else False
+		if self.IsMine(lease):
+			self.held = True
+			os.utime(self.path)
+			return True
+		if not breakExpired or (age < self.timeout and not self.IsOrphaned(lease)):
+			return False
+		# move the expired lease aside first, so only one marker can break it
+		stale_path = "%s.%s-%d.stale" % (self.path, self.host, self.pid)
+		try:
+			os.rename(self.path, stale_path)
+		except OSError:
+			return False
+		lease, age = self.ReadLeaseFile(stale_path)
+		if age < self.timeout and not self.IsOrphaned(lease): # renewed or re-taken in the meantime, put it back
+			try:
+				os.link(stale_path, self.path)
+			except FileExistsError: # its holder has already re-created it
+				pass
+			except OSError: # no hard links on this file system
+				if not os.path.exists(self.path):
+					os.rename(stale_path, self.path)
+					return False
+			os.remove(stale_path)
+			return False
+		os.remove(stale_path)
+		logging.info("Took over %s lease on '%s' from %s" % ("expired" if age >= self.timeout else "abandoned",
+			os.path.split(self.dir)[-1], lease["user"] if lease else "an unknown marker"))
+		return self.Acquire(False)
+		
+	def Renew(self):
+		if self.held:
+			lease, age = self.ReadLease(self.dir)
+			if age is None: # briefly moved aside by a marker checking whether it had expired
+				self.held = False
+				if self.Acquire(False):
+					return
+			if not self.IsMine(lease):
+				logging.warning("Lost lease on '%s'" % os.path.split(self.dir)[-1])
+				self.held = False
+				return
+			os.utime(self.path)
+		
+	def Release(self):
+		if self.held and self.IsMine(self.ReadLease(self.dir)[0]):
+			os.remove(self.path)
+		self.held = False
+
+def NaturalSortKey(name):
+	# so that "cand2" comes before "cand10"
+	return [int(t) if t.isdigit() else t.lower() for t in re.split(r"(\d+)", name)]
+
+class CandidateCatalog:
+	# all candidates in natural sort order, with a cached status per candidate so that views can be filtered without loading marks
+	filterNames = ["all", "incomplete", "unstarted", "complete", "strokes", "score", "name"]
+	statusVersion = 3
+	
+	def __init__(self, internalDir, markScheme=None, markSchemeFile=None):
+		self.internalDir = internalDir
+		self.markScheme = markScheme
+		self.markSchemeTime = os.path.getmtime(markSchemeFile) if markSchemeFile and os.path.exists(markSchemeFile) else None
+		self.statusFile = os.path.join(internalDir, "status.json")
+		self.dirs = [] # all candidate dirs
+		self.keys = [] # sort keys of self.dirs
+		self.index = {} # dir -> position in self.dirs
+		self.status = {} # candidate name -> status dict
+		self.statusDirty = False
+		self.filter = ["all"]
+		self.view = [] # sorted positions (in self.dirs) of the candidates that pass the filter
+		self.questionGuesses = {} # question -> typical start page, over candidates that have tallied it
+		
+	def __len__(self):
+		return len(self.dirs)
+	
+	def __contains__(self, dir):
+		return dir in self.index
+		
+	def IsCandidateDir(self, dir):
+		if dir.endswith(".ingest"): # still being written
+			return False
+		return os.path.exists(os.path.join(dir, marksFileName)) or os.path.exists(os.path.join(dir, "marks.pickle"))
+		
+	def Load(self):
+		# returns the candidates whose cached status is out of date, for the caller to recheck
+		dirs = [e.path for e in os.scandir(self.internalDir) if e.is_dir() and self.IsCandidateDir(e.path)] if os.path.exists(self.internalDir) else []
+		self.SetDirs(dirs)
+		self.LoadStatus()
+		self.ApplyFilter()
+		return [dir for dir in self.dirs if self.IsStale(dir)]
+		
+	def SetDirs(self, dirs):
+		self.dirs = sorted(dirs, key=lambda d: NaturalSortKey(os.path.split(d)[-1]))
+		self.keys = [NaturalSortKey(os.path.split(d)[-1]) for d in self.dirs]
+		self.index = {self.dirs[i] : i for i in range(len(self.dirs))}
+		
+	def Add(self, dir):
+		# a newly ingested candidate
+		if dir in self.index:
+			return
+		self.SetDirs(self.dirs + [dir])
+		if self.IsStale(dir):
+			self.UpdateStatus(Candidate(dir), False)
+		self.ApplyFilter()
+		
+	def LoadStatus(self):
+		self.status = {}
+		if not os.path.exists(self.statusFile):
+			return
+		try:
+			with open(self.statusFile, "r") as f:
+				data = json.load(f)
+			if data.get("version")==self.statusVersion and data.get("markScheme")==self.markSchemeTime:
+				self.status = data["candidates"]
+		except Exception:
+			logging.exception("Failed to load candidate status, it will be rebuilt")
+	
+	def SaveStatus(self):
+		if not self.statusDirty:
+			return
+		data = {"version" : self.statusVersion, "markScheme" : self.markSchemeTime, "candidates" : self.status}
+		ReplaceFile(self.statusFile, json.dumps(data)) # shared between markers, but it is only a cache
+		self.statusDirty = False
+		logging.debug("Saved candidate status")
+		
+	def IsStale(self, dir):
+		status = self.GetStatus(dir)
+		return not status or status["mtime"] != GetMarksTime(dir)
+		
+	def UpdateStatus(self, candidate, refilter=True):
+		self.SetStatus(candidate.dir, CandidateStatus(candidate, self.markScheme), refilter)
+		
+	def SetStatus(self, dir, status, refilter=True):
+		old_status = self.GetStatus(dir)
+		if old_status and old_status["mtime"] and status["mtime"] and old_status["mtime"] > status["mtime"]:
+			return # computed from marks that have since been saved again
+		self.status[os.path.split(dir)[-1]] = status
+		self.statusDirty = True
+		self.questionGuesses = {}
+		if refilter and dir in self.index:
+			pos = self.index[dir]
+			i = bisect.bisect_left(self.view, pos)
+			inView = i < len(self.view) and self.view[i]==pos
+			if self.Matches(dir) and not inView:
+				self.view.insert(i, pos)
+			elif not self.Matches(dir) and inView:
+				del self.view[i]
+		
+	def GetStatus(self, dir):
+		return self.status.get(os.path.split(dir)[-1])
+		
+	def Matches(self, dir):
+		kind = self.filter[0]
+		if kind=="all":
+			return True
+		status = self.GetStatus(dir)
+		if not status: # not checked yet
+			return kind=="incomplete"
+		if kind=="incomplete":
+			return not status["complete"]
+		elif kind=="unstarted":
+			return status["nMarks"]==0
+		elif kind=="complete":
+			return status["complete"]
+		elif kind=="strokes":
+			return status["strokes"]
+		elif kind=="score":
+			return self.filter[1] <= status["score"] <= self.filter[2]
+		elif kind=="name":
+			return self.filter[1].lower() in os.path.split(dir)[-1].lower()
+		return True
+		
+	def SetFilter(self, text):
+		# e.g. "incomplete", "score 10 20", "name smith"; empty for all
+		words = text.split()
+		if len(words)==0:
+			words = ["all"]
+		kind = words[0].lower()
+		if kind not in self.filterNames:
+			raise ValueError("Unknown filter '%s'" % kind)
+		if kind=="score":
+			if len(words) != 3:
+				raise ValueError("Score filter needs a range, e.g. 'score 10 20'")
+			filter = [kind, int(words[1]), int(words[2])]
+		elif kind=="name":
+			if len(words) != 2:
+				raise ValueError("Name filter needs a name, e.g. 'name smith'")
+			filter = [kind, words[1]]
+		else:
+			filter = [kind]
+		self.filter = filter
+		self.ApplyFilter()
+		logging.info("Candidate filter '%s', %d/%d candidates" % (" ".join(str(w) for w in filter), len(self.view), len(self.dirs)))
+		
+	def ApplyFilter(self):
+		self.view = [i for i in range(len(self.dirs)) if self.Matches(self.dirs[i])]
+	
+	def GetFilterText(self):
+		return " ".join(str(w) for w in self.filter)
+		
+	def ViewPosition(self, dir):
+		# position of dir within the current view, or None if it is filtered out
+		pos = self.index[dir]
+		i = bisect.bisect_left(self.view, pos)
+		return i if i < len(self.view) and self.view[i]==pos else None
+		
+	def GetKnownQuestionStart(self, status, q):
+		questions = status.get("questions", [])
+		if q < len(questions):
+			return tuple(questions[q][:2])
+		if q > 0 and q-1 < len(questions): # starts where the previous question was tallied
+			return tuple(questions[q-1][2:])
+		return None
+		
+	def GetQuestionStart(self, dir, q):
+		# (page, y) where question q starts for this candidate, from its own tally marks if it has them, otherwise guessed from other candidates
+		status = self.GetStatus(dir)
+		if status:
+			start = self.GetKnownQuestionStart(status, q)
+			if start:
+				return start
+		if q not in self.questionGuesses:
+			starts = [self.GetKnownQuestionStart(s, q) for s in self.status.values()]
+			pages = [start[0] for start in starts if start]
+			self.questionGuesses[q] = int(np.median(pages)) if pages else 0
+		page = self.questionGuesses[q]
+		if status:
+			page = min(page, status["nPages"]-1)
+		return page, 0
+		
+	def NextUnclaimed(self, dir, user):
+		# the first incomplete candidate after dir in the current view (wrapping round) that no other marker holds a lease on
+		if not self.view:
+			return None
+		start = self.ViewPosition(self.Step(dir, 1)) if dir in self.index else 0
+		for k in range(len(self.view)):
+			next_dir = self.dirs[self.view[(start+k) % len(self.view)]]
+			if next_dir==dir:
+				continue
+			holder = CandidateLease.GetHolder(next_dir)
+			if holder and holder != user:
+				continue
+			if self.IsStale(next_dir): # another marker may have changed it
+				self.UpdateStatus(Candidate(next_dir), False)
+			status = self.GetStatus(next_dir)
+			if not status["complete"]:
+				return next_dir
+		return None
+		
+	def First(self):
+		return self.dirs[self.view[0]] if self.view else None
+		
+	def Step(self, dir, step):
+		# the candidate step places from dir within the current view; dir need not itself be in the view
+		if not self.view:
+			return dir
+		pos = self.index[dir]
+		i = bisect.bisect_left(self.view, pos)
+		if (i >= len(self.view) or self.view[i] != pos) and step > 0:
+			i -= 1
+		target = min(max(i+step, 0), len(self.view)-1)
+		return self.dirs[self.view[target]]
+	
+def DrawMarks(painter, marks, w, h, penSize, marginX=None):
+	# draw marks in page coordinates onto a page of size (w,h); marginX is only drawn when marking against a scheme
+	painter.setRenderHint(QtGui.QPainter.Antialiasing, True)
+	painter.setCompositionMode(QtGui.QPainter.CompositionMode_SourceOver)	
+	painter.setPen(QtGui.QPen(Qt.red,  4, Qt.SolidLine))
+	# mark types: strike, score, tally, justify, circle, leftarrow, rightarrow
+	for mark in marks:
+		if mark.type==Mark.STRIKE:
+			painter.setOpacity(0.5)
+			painter.drawLine(int(w/2/0.9), int(h*0.02), int(w/2*0.9), int(h*0.98))								
+			painter.setOpacity(1)
+		elif mark.type==Mark.CIRCLE:
+			painter.drawEllipse(int(mark.x-mark.w/2), int(mark.y-mark.h/2), int(mark.w), int(mark.h))
+		elif mark.type==Mark.JUSTIFY:
+			painter.setFont(QtGui.QFont("sanserif", int(mark.h*0.5)))
+			rect = QtCore.QRect(int(mark.x-mark.w/2), int(mark.y-mark.h/2), int(mark.w), int(mark.h))
+			painter.drawText(rect, Qt.AlignCenter, "justify")			
+		elif mark.type==Mark.SCORE or mark.type==Mark.TALLY:
+			painter.setFont(QtGui.QFont("sanserif", int(mark.h*0.8)))
+			rect = QtCore.QRect(int(mark.x-mark.w/2), int(mark.y-mark.h/2), int(mark.w), int(mark.h))
+			painter.drawText(rect, Qt.AlignCenter, str(int(mark.score)))
+			if mark.type==Mark.TALLY:
+				painter.drawRect(rect)
+		elif mark.type==Mark.LEFTARROW:
+			painter.drawLine(int(mark.x-mark.w/2), mark.y, int(mark.x+mark.w/2), int(mark.y))
+			painter.drawLine(int(mark.x-mark.w/2+mark.h/4), int(mark.y-mark.h/4), int(mark.x-mark.w/2), int(mark.y))
+			painter.drawLine(int(mark.x-mark.w/2+mark.h/4), int(mark.y+mark.h/4), int(mark.x-mark.w/2), int(mark.y))
+		elif mark.type==Mark.RIGHTARROW:
+			painter.drawLine(int(mark.x-mark.w/2), mark.y, int(mark.x+mark.w/2), int(mark.y))
+			painter.drawLine(int(mark.x+mark.w/2-mark.h/4), int(mark.y-mark.h/4), int(mark.x+mark.w/2), int(mark.y))
+			painter.drawLine(int(mark.x+mark.w/2-mark.h/4), int(mark.y+mark.h/4), int(mark.x+mark.w/2), int(mark.y))
+		elif mark.type==Mark.TOUCH:
+			painter.setPen(QtGui.QPen(Qt.red,  penSize, Qt.SolidLine, Qt.RoundCap, Qt.RoundJoin))
+			posList = mark.posList.tolist()
+			for i in range(len(posList)-1):
+				x1, y1 = posList[i]
+				x2, y2 = posList[i+1]
+				painter.drawLine(int(x1), int(y1), int(x2), int(y2))
+			painter.setPen(QtGui.QPen(Qt.red,  4, Qt.SolidLine))
+	# margin		
+	if marginX:
+		painter.setPen(QtGui.QPen(Qt.red,  4, Qt.DashLine))
+		painter.drawLine(marginX, 0, marginX, h)
+
+def RenderPage(background, marks, penSize, marginX=None):
+	# QImage in, QImage out, so this is safe to call from a job
+	image = background.convertToFormat(QtGui.QImage.Format_RGB32)
+	painter = QtGui.QPainter(image)
+	DrawMarks(painter, marks, image.width(), image.height(), penSize, marginX)
+	painter.end()
+	return image
+
+class JobSignals(QtCore.QObject):
+	progress = QtCore.pyqtSignal(int, int) # done, total
+	candidateReady = QtCore.pyqtSignal(str) # candidate dir
+	status = QtCore.pyqtSignal(str, object) # candidate dir, status
+	finished = QtCore.pyqtSignal(bool) # False if cancelled or failed
+
+class Job(QtCore.QRunnable):
+	# fn(job, *args) runs on a worker thread; it must not touch widgets, should report via job.Progress and return early once job.IsCancelled()
+	def __init__(self, name, fn, *args):
+		QtCore.QRunnable.__init__(self)
+		self.setAutoDelete(False)
+		self.name = name
+		self.fn = fn
+		self.args = args
+		self.inputDir = None # scripts dir the job works on, if any
+		self.signals = JobSignals()
+		self.cancelled = threading.Event()
+		self.done = 0
+		self.total = 0
+		
+	def run(self):
+		ok = False
+		try:
+			if not self.IsCancelled():
+				logging.info("Job '%s' started" % self.name)
+				ok = self.fn(self, *self.args) != False and not self.IsCancelled()
+				logging.info("Job '%s' %s" % (self.name, "finished" if ok else "cancelled"))
+		except Exception as e:
+			logging.exception("Job '%s' failed: %s" % (self.name, str(e)))
+		self.signals.finished.emit(ok)
+		
+	def Progress(self, done, total):
+		self.done = done
+		self.total = total
+		self.signals.progress.emit(done, total)
+		
+	def Cancel(self):
+		self.cancelled.set()
+		
+	def IsCancelled(self):
+		return self.cancelled.is_set()
+
+class JobQueue(QtCore.QObject):
+	# runs jobs one at a time on a background thread, in the order they were submitted
+	changed = QtCore.pyqtSignal()
+	
 	def __init__(self, parent=None):
+		QtCore.QObject.__init__(self, parent)
+		self.pool = QtCore.QThreadPool(self)
+		self.pool.setMaxThreadCount(1)
+		self.jobs = [] # running job first, then queued ones
+		
+	def Submit(self, job):
+		for other in self.jobs:
+			if other.name==job.name and other.inputDir==job.inputDir and not other.IsCancelled():
+				logging.info("Job '%s' is already queued" % job.name)
+				return None
+		job.signals.progress.connect(lambda done, total: self.changed.emit())
+		job.signals.finished.connect(lambda ok, job=job: self.OnFinished(job))
+		self.jobs.append(job)
+		self.pool.start(job)
+		self.changed.emit()
+		return job
+	
+	def OnFinished(self, job):
+		self.jobs.remove(job)
+		self.changed.emit()
+		
+	def CancelAll(self):
+		for job in self.jobs:
+			job.Cancel()
+		self.changed.emit()
+		
+	def CancelFor(self, inputDir):
+		for job in self.jobs:
+			if job.inputDir==inputDir:
+				job.Cancel()
+		self.changed.emit()
+		
+	def Wait(self):
+		self.pool.waitForDone()
+		
+	def GetStatusText(self):
+		if not self.jobs:
+			return ""
+		job = self.jobs[0]
+		text = "%s... (%d/%d)" % ("Cancelling" if job.IsCancelled() else job.name, job.done, job.total)
+		if len(self.jobs) > 1:
+			text += " +%d queued" % (len(self.jobs)-1)
+		return text
+
+def ExtractImagesFromPDF(filename_pdf):
+	# yields the scanned page images one at a time, so that only one page is in memory however long the script is
+	min_width = 128
+	min_height = 16
+	doc = fitz.open(filename_pdf)
+	last_hash = None
+	try:
+		for i in range(len(doc)):
+			for img in doc.getPageImageList(i):
+				xref = img[0]
+				pix = fitz.Pixmap(doc, xref)
+				if pix.width <= min_width and pix.height <= min_height:
+					continue
+				if pix.alpha:
+					pix = fitz.Pixmap(pix, 0)
+				if pix.n > 3: # CMYK: convert to RGB
+					pix = fitz.Pixmap(fitz.csRGB, pix)
+				samples = pix.samples
+				# dedup in case clipped copies are used on successive pdf pages (e.g. to avoid downscaling)
+				image_hash = (pix.width, pix.height, hashlib.sha1(samples).digest())
+				if image_hash == last_hash:
+					continue
+				last_hash = image_hash
+				image = Image.frombytes("L" if pix.n==1 else "RGB", (pix.width, pix.height), samples)
+				pix = samples = None
+				yield image
+	finally:
+		doc.close()
+	
+def IngestScripts(job, inputDir, internalDir, files=None):
+	# files defaults to every pdf in inputDir
+	x_dim, y_dim = (2480,3508) # A4 paper at 300 dpi
+	if not os.path.exists(internalDir):
+		os.mkdir(internalDir)
+	if files is None:
+		files = glob.glob(os.path.join(inputDir, "*.pdf"))
+	files = sorted(files, key=lambda f: NaturalSortKey(os.path.split(f)[1]))
+	for i in range(len(files)):
+		if job.IsCancelled():
+			return False
+		job.Progress(i, len(files))
+		filename_pdf = files[i]
+		candidate_name = os.path.split(filename_pdf)[1][:-4]
+		candidate_dir = os.path.join(internalDir, candidate_name)
+		if os.path.exists(candidate_dir):
+			logging.info("Candidate directory for '%s' already exists, skipping." % filename_pdf)
+			continue
+		logging.info("Processing '%s' (%d/%d)" % (filename_pdf, i+1, len(files)))
+		# renamed once complete, so nobody sees a half written candidate; named for this process, as other markers
+		# watching the same scripts dir may be ingesting the same pdf
+		working_dir = "%s.%s-%d-%d.ingest" % (candidate_dir, socket.gethostname(), os.getpid(), threading.get_ident())
+		try:
+			if os.path.exists(working_dir): # left behind by this process, cancelled
+				shutil.rmtree(working_dir)
+			os.mkdir(working_dir)
+			n_pages = 0
+			for image in ExtractImagesFromPDF(filename_pdf):
+				if job.IsCancelled():
+					shutil.rmtree(working_dir)
+					return False
+				w, h = x_dim, int(image.height/image.width*x_dim)
+				image = image.resize((w,h))
+				image.save(GetPagePath(working_dir, n_pages), dpi=(300,300))
+				n_pages += 1
+			SaveMarksFile(os.path.join(working_dir, marksFileName), [[] for j in range(n_pages)])
+			try:
+				os.rename(working_dir, candidate_dir)
+			except OSError:
+				if not os.path.exists(candidate_dir):
+					raise
+				logging.info("'%s' was input by another marker meanwhile" % filename_pdf)
+				shutil.rmtree(working_dir, ignore_errors=True)
+		except Exception as e:
+			logging.exception("Failed to input script from  '%s': %s" % (filename_pdf, str(e)))
+			shutil.rmtree(working_dir, ignore_errors=True)
+			continue
+		job.signals.candidateReady.emit(candidate_dir)
+	job.Progress(len(files), len(files))
+	
+def ExportScripts(job, dirs, outDir, penSize, marginX):
+	# within a temporary dir, write each page to jpg and then convert to pdf
+	shutil.rmtree(outDir)
+	os.mkdir(outDir)
+	for i in range(len(dirs)):
+		if job.IsCancelled():
+			return False
+		job.Progress(i, len(dirs))
+		try:
+			candidate = Candidate(dirs[i], False)
+			out_working_dir = tempfile.mkdtemp(prefix="pdf-marker-")
+			try:
+				for j in range(len(candidate.marks)):
+					image = RenderPage(QtGui.QImage(candidate.GetPagePath(j)), candidate.marks[j], penSize, marginX)
+					out_path = os.path.join(out_working_dir, "%03d_"%(j)+".jpg")
+					image.save(out_path, "jpg")
+				marked_jpgs = sorted(glob.glob(os.path.join(out_working_dir,"*")))
+				pdf = fpdf.FPDF(unit="mm", format=[210,297]) # A4 in mm
+				for image in marked_jpgs:
+					pdf.add_page()
+					pdf.set_margins(10,10,10)					
+					with Image.open(image) as im:
+						w = im.width/(2480/190) # rescale from A4 at 300 dpi
+						h = im.height/(3509/297)
+					scale = 1
+					scale = min(scale, 170/w)
+					scale = min(scale, 277/h)
+					pdf.image(image, 10, 10, int(w*scale), int(h*scale))
+				pdf.output(os.path.join(outDir, candidate.name+".pdf"), "F")
+			finally:
+				shutil.rmtree(out_working_dir)
+		except Exception as e: # one bad candidate shouldn't stop the rest
+			logging.exception("Failed to write marked pdf for '%s': %s" % (os.path.split(dirs[i])[-1], str(e)))
+			continue
+		logging.info("Wrote marked pdf for '%s' (%d/%d)" % (candidate.name, i+1, len(dirs)))
+	job.Progress(len(dirs), len(dirs))
+	
+def WriteResults(job, dirs, outDir, markScheme):
+	questions_str = ""
+	part_questions_str = ""
+	for i in range(len(markScheme.qs_max)):
+		questions_str += "Q" + str(i+1) + "," 
+		for label in markScheme.part_qs_str[i]:
+			part_questions_str += str(i+1) + label + ","
+	
+	csv_tots	= "Candidate,Total,\n"
+	csv_qs		= "Candidate, " + questions_str + "Total,\n"
+	csv_part_qs = "Candidate," + part_questions_str + "Total,\n"
+	csv_exam	= ""
+	
+	for i in range(len(dirs)):
+		if job.IsCancelled():
+			return False
+		job.Progress(i, len(dirs))
+		try:
+			candidate = Candidate(dirs[i], False)
+			qs, part_qs = candidate.CollateMarks()
+		except Exception as e: # one bad candidate shouldn't stop the rest
+			logging.exception("Failed to read marks for '%s', left out of the results: %s" % (os.path.split(dirs[i])[-1], str(e)))
+			continue
+		qs_str = ",".join(str(x) for x in qs)
+		part_qs_str = ",".join(str(x) for x in list(itertools.chain.from_iterable(part_qs)))		
+		tot_str = str(np.sum(qs, dtype=int))
+		
+		csv_tots += candidate.name + "," + tot_str + ",\n"
+		csv_qs += candidate.name + "," + qs_str + "," + tot_str + ",\n"
+		csv_part_qs += candidate.name + "," + part_qs_str + "," + tot_str + ",\n"
+		csv_exam += candidate.name + "," + tot_str + "\n"
+		
+	with open(os.path.join(outDir, "out_totals.csv"), "w") as csv:
+		csv.write(csv_tots)
+	with open(os.path.join(outDir, "out_qs.csv"), "w") as csv:
+		csv.write(csv_qs)
+	with open(os.path.join(outDir, "out_part_qs.csv"), "w") as csv:
+		csv.write(csv_part_qs)
+	with open(os.path.join(outDir, "out_somas_upload_format.csv"), "w") as csv:
+		csv.write(csv_exam)
+	job.Progress(len(dirs), len(dirs))
+	logging.info("Wrote csv files, output complete")
+	
+def RecheckCandidates(job, dirs, markScheme):
+	for i in range(len(dirs)):
+		if job.IsCancelled():
+			return False
+		if i % 50 == 0:
+			job.Progress(i, len(dirs))
+		try:
+			job.signals.status.emit(dirs[i], CandidateStatus(Candidate(dirs[i], False), markScheme))
+		except Exception as e: # one bad candidate shouldn't stop the rest
+			logging.exception("Failed to check '%s': %s" % (os.path.split(dirs[i])[-1], str(e)))
+	job.Progress(len(dirs), len(dirs))
+
+class ScriptWatcher(QtCore.QObject):
+	# polls the scripts dir for pdfs that are not yet ingested, and reports them once their size has stopped changing;
+	# polling rather than file system notifications, as scans are often dropped onto network shares
+	ready = QtCore.pyqtSignal(list)
+	
+	def __init__(self, inputDir, internalDir, interval=2000, parent=None):
+		QtCore.QObject.__init__(self, parent)
+		self.inputDir = inputDir
+		self.internalDir = internalDir
+		self.sizes = {} # path -> (size, mtime) at the last poll
+		self.submitted = {} # path -> (size, mtime) when it was handed on, so that a pdf that fails to ingest isn't retried until it changes
+		self.timer = QtCore.QTimer(self)
+		self.timer.timeout.connect(self.Poll)
+		self.timer.start(interval)
+		
+	def Poll(self):
+		sizes = {}
+		ready = []
+		for path in glob.glob(os.path.join(self.inputDir, "*.pdf")):
+			try:
+				stat = os.stat(path)
+			except OSError:
+				continue # removed since listing
+			size = (stat.st_size, stat.st_mtime_ns)
+			sizes[path] = size
+			if size[0] == 0 or self.sizes.get(path) != size or self.submitted.get(path) == size:
+				continue # still being written, or nothing new
+			if not self.IsIngested(path):
+				ready.append(path)
+		self.sizes = sizes
+		if ready:
+			self.ready.emit(ready)
+			
+	def IsIngested(self, path):
+		return os.path.exists(os.path.join(self.internalDir, os.path.split(path)[1][:-4]))
+		
+	def MarkSubmitted(self, files):
+		for path in files:
+			self.submitted[path] = self.sizes[path]
+			
+	def OnFinished(self, files, ok):
+		# a cancelled job leaves some files not yet ingested, those are offered again; files it tried and failed on are not
+		if not ok:
+			for path in files:
+				if not self.IsIngested(path):
+					self.submitted.pop(path, None)
+			
+	def Stop(self):
+		self.timer.stop()
+
+class PageLoaderSignals(QtCore.QObject):
+	loaded = QtCore.pyqtSignal(str, QtGui.QImage)
+
+class PageLoader(QtCore.QRunnable):
+	def __init__(self, path):
+		QtCore.QRunnable.__init__(self)
+		self.setAutoDelete(False)
+		self.path = path
+		self.signals = PageLoaderSignals()
+		
+	def run(self):
+		self.signals.loaded.emit(self.path, QtGui.QImage(self.path))
+
+class PageCache(QtCore.QObject):
+	# the most recently used page images, plus pages prefetched on background threads
+	def __init__(self, size=6, parent=None):
+		QtCore.QObject.__init__(self, parent)
+		self.size = size # a 300 dpi A4 page is ~35MB decoded
+		self.images = collections.OrderedDict() # path -> QImage, least recently used first
+		self.pending = {} # path -> PageLoader
+		self.pool = QtCore.QThreadPool(self)
+		self.pool.setMaxThreadCount(2)
+		
+	def Get(self, path):
+		if path in self.images:
+			self.images.move_to_end(path)
+			return self.images[path]
+		image = QtGui.QImage(path)
+		self.Put(path, image)
+		return image
+		
+	def Prefetch(self, path):
+		if path in self.images or path in self.pending:
+			return
+		loader = PageLoader(path)
+		loader.signals.loaded.connect(self.OnLoaded)
+		self.pending[path] = loader
+		self.pool.start(loader)
+		
+	def OnLoaded(self, path, image):
+		del self.pending[path]
+		if path not in self.images:
+			self.Put(path, image)
+			
+	def Put(self, path, image):
+		self.images[path] = image
+		self.images.move_to_end(path)
+		while len(self.images) > self.size:
+			self.images.popitem(last=False)
+			
+	def Clear(self):
+		self.images.clear()
+
+def RenderTile(background, marks, scale, tx, ty, tileSize, penSize, marginX=None):
+	# the (tx,ty)th tileSize square of the page drawn at scale screen pixels per page pixel, marks included
+	x0, y0 = tx*tileSize/scale, ty*tileSize/scale # top left of the tile, in page coordinates
+	tile = QtGui.QImage(tileSize, tileSize, QtGui.QImage.Format_RGB32)
+	tile.fill(Qt.white)
+	painter = QtGui.QPainter(tile)
+	source = QtCore.QRectF(x0, y0, tileSize/scale, tileSize/scale).toAlignedRect().intersected(background.rect())
+	if not source.isEmpty():
+		# smooth scaling of just this part of the page, much cheaper than scaling the whole page
+		part = background.copy(source).scaled(max(1, round(source.width()*scale)), max(1, round(source.height()*scale)), 
+					Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+		painter.drawImage(QtCore.QPointF((source.x()-x0)*scale, (source.y()-y0)*scale), part)
+	painter.scale(scale, scale)
+	painter.translate(-x0, -y0)
+	DrawMarks(painter, marks, background.width(), background.height(), penSize, marginX)
+	painter.end()
+	return tile
+
+class TileCache:
+	# the most recently drawn tiles of the page on screen, so that panning only draws tiles it has not drawn before
+	tileSize = 256
+	
+	def __init__(self, size=384):
+		self.size = size # 256x256 tiles are 256KB each
+		self.tiles = collections.OrderedDict() # key -> QPixmap, least recently used first
+		
+	def Get(self, key, render):
+		# key identifies what is drawn, render() draws it as a QImage if it is not cached
+		if key in self.tiles:
+			self.tiles.move_to_end(key)
+			return self.tiles[key]
+		tile = QtGui.QPixmap.fromImage(render())
+		self.tiles[key] = tile
+		while len(self.tiles) > self.size:
+			self.tiles.popitem(last=False)
+		return tile
+		
+	def Clear(self):
+		self.tiles.clear()
+
+def GetThumbnailPath(dir, i):
+	return os.path.join(dir, "thumbs", "%03d.png" % i)
+	
+def RenderThumbnail(path, marks, width, penSize, marginX=None):
+	# page image at the given width with its marks, decoding the jpg at reduced size; safe to call from a thread
+	reader = QtGui.QImageReader(path)
+	size = reader.size()
+	scale = width/size.width()
+	reader.setScaledSize(QtCore.QSize(width, max(1, round(size.height()*scale))))
+	image = reader.read().convertToFormat(QtGui.QImage.Format_RGB32)
+	painter = QtGui.QPainter(image)
+	painter.scale(scale, scale)
+	DrawMarks(painter, marks, size.width(), size.height(), penSize, marginX)
+	painter.end()
+	return image
+	
+def LoadThumbnail(dir, i, width, penSize, marginX=None):
+	# the thumbnail of page i from its cache file, redrawn if the marks have been saved since; returns (mtime of the marks drawn, QImage)
+	marks_path = os.path.join(dir, marksFileName)
+	mtime, mtime_ns = 0, 0
+	if os.path.exists(marks_path): # before loading them, so that marks saved meanwhile are seen as newer than the thumbnail
+		stat = os.stat(marks_path)
+		mtime, mtime_ns = stat.st_mtime, stat.st_mtime_ns
+	path = GetThumbnailPath(dir, i)
+	image = None
+	if os.path.exists(path) and os.stat(path).st_mtime_ns == mtime_ns:
+		image = QtGui.QImage(path)
+	if not image or image.isNull() or image.width() != width:
+		candidate = Candidate(dir, False)
+		candidate.TallyMarks()
+		image = RenderThumbnail(candidate.GetPagePath(i), candidate.marks[i], width, penSize, marginX)
+		if not os.path.exists(os.path.dirname(path)):
+			os.makedirs(os.path.dirname(path), exist_ok=True)
+		data = QtCore.QByteArray()
+		buffer = QtCore.QBuffer(data)
+		buffer.open(QtCore.QIODevice.WriteOnly)
+		image.save(buffer, "PNG")
+		ReplaceFile(path, bytes(data))
+		os.utime(path, ns=(mtime_ns, mtime_ns)) # stamped with the marks time, so a thumbnail is current iff the two match
+	return mtime, image
+
+class ThumbnailLoaderSignals(QtCore.QObject):
+	loaded = QtCore.pyqtSignal(object, float, QtGui.QImage) # loader, marks mtime, image
+
+class ThumbnailLoader(QtCore.QRunnable):
+	def __init__(self, dir, page, width, penSize, marginX):
+		QtCore.QRunnable.__init__(self)
+		self.setAutoDelete(False)
+		self.args = (dir, page, width, penSize, marginX)
+		self.cancelled = False # set once the cell has scrolled out of view, before this started
+		self.signals = ThumbnailLoaderSignals()
+		
+	def run(self):
+		if self.cancelled:
+			self.signals.loaded.emit(self, 0, QtGui.QImage())
+			return
+		try:
+			self.signals.loaded.emit(self, *LoadThumbnail(*self.args))
+		except Exception:
+			logging.exception("Failed to load thumbnail of '%s' page %d" % self.args[:2])
+			self.signals.loaded.emit(self, 0, QtGui.QImage())
+
+class ThumbnailModel(QtCore.QAbstractListModel):
+	# one cell per (dir, page); thumbnails are only loaded when the view asks for a cell, and only the most recently used are kept
+	def __init__(self, catalog, width=150, penSize=5, marginX=None, checkStrikes=False, size=400, parent=None):
+		QtCore.QAbstractListModel.__init__(self, parent)
+		self.catalog = catalog
+		self.width = width
+		self.penSize = penSize
+		self.marginX = marginX
+		self.checkStrikes = checkStrikes # highlight pages without a strike, as CheckMarks would complain about them
+		self.size = size # a 150px wide thumbnail is ~130KB
+		self.cells = [] # (dir, page)
+		self.rows = {} # (dir, page) -> row
+		self.thumbs = collections.OrderedDict() # (dir, page) -> (marks mtime, QPixmap), least recently used first
+		self.pending = {} # (dir, page) -> ThumbnailLoader
+		self.loaders = set() # every loader not yet finished, including cancelled ones
+		self.pool = QtCore.QThreadPool(self)
+		self.pool.setMaxThreadCount(2)
+		self.placeholder = QtGui.QPixmap(width, round(width*297/210)) # A4
+		self.placeholder.fill(Qt.lightGray)
+		
+	def SetCells(self, cells):
+		self.beginResetModel()
+		self.CancelPending()
+		self.cells = cells
+		self.rows = {cell : i for i, cell in enumerate(cells)}
+		self.endResetModel()
+		
+	def rowCount(self, parent=QtCore.QModelIndex()):
+		return 0 if parent.isValid() else len(self.cells)
+		
+	def data(self, index, role=Qt.DisplayRole):
+		cell = self.cells[index.row()]
+		if role == Qt.DisplayRole:
+			return "%s p%d" % (os.path.split(cell[0])[-1], cell[1]+1)
+		if role == Qt.DecorationRole:
+			thumb = self.GetThumb(cell)
+			return thumb[1] if thumb else self.placeholder
+		if role == Qt.BackgroundRole and self.IsUnstruck(cell):
+			return QtGui.QBrush(QtGui.QColor(255, 200, 0))
+		if role == Qt.ToolTipRole and self.IsUnstruck(cell):
+			return "Strike missing"
+		return None
+		
+	def IsUnstruck(self, cell):
+		if not self.checkStrikes:
+			return False
+		status = self.catalog.GetStatus(cell[0])
+		return bool(status) and cell[1] in status["unstruck"]
+		
+	def GetThumb(self, cell):
+		thumb = self.thumbs.get(cell)
+		status = self.catalog.GetStatus(cell[0])
+		if thumb and (not status or thumb[0] == (status["mtime"] or 0)):
+			self.thumbs.move_to_end(cell)
+			return thumb
+		if cell not in self.pending:
+			loader = ThumbnailLoader(cell[0], cell[1], self.width, self.penSize, self.marginX)
+			loader.signals.loaded.connect(self.OnLoaded)
+			self.pending[cell] = loader
+			self.loaders.add(loader)
+			self.pool.start(loader)
+		return thumb # the old one until the new one arrives
+		
+	def OnLoaded(self, loader, mtime, image):
+		self.loaders.discard(loader)
+		cell = loader.args[:2]
+		if self.pending.get(cell) is loader:
+			del self.pending[cell]
+		if image.isNull():
+			return
+		self.thumbs[cell] = (mtime, QtGui.QPixmap.fromImage(image))
+		self.thumbs.move_to_end(cell)
+		while len(self.thumbs) > self.size:
+			self.thumbs.popitem(last=False)
+		if cell in self.rows:
+			index = self.index(self.rows[cell])
+			self.dataChanged.emit(index, index)
+			
+	def CancelPending(self):
+		# called as the view scrolls, so that a fast scroll does not leave a long queue of cells nobody is looking at;
+		# the cells still in view are asked for again when they are repainted
+		for loader in self.pending.values():
+			loader.cancelled = True
+		self.pending.clear()
+		
+	def Wait(self):
+		self.CancelPending()
+		self.pool.waitForDone()
+
+class ThumbnailOverview(QtWidgets.QListView):
+	# a grid of page thumbnails, clicking one jumps to that page
+	pageSelected = QtCore.pyqtSignal(str, int)
+	
+	def __init__(self, model, parent=None):
+		QtWidgets.QListView.__init__(self, parent)
+		self.setWindowFlags(Qt.Window)
+		self.setModel(model)
+		self.setViewMode(QtWidgets.QListView.IconMode)
+		self.setMovement(QtWidgets.QListView.Static)
+		self.setResizeMode(QtWidgets.QListView.Adjust)
+		self.setUniformItemSizes(True) # so laying out 10,000 cells doesn't ask for each one
+		self.setIconSize(model.placeholder.size())
+		self.setGridSize(model.placeholder.size() + QtCore.QSize(16, 32))
+		self.setSpacing(4)
+		self.verticalScrollBar().valueChanged.connect(model.CancelPending)
+		self.clicked.connect(self.OnClicked)
+		
+	def OnClicked(self, index):
+		dir, page = self.model().cells[index.row()]
+		self.hide()
+		self.pageSelected.emit(dir, page)
+		
+	def keyPressEvent(self, event):
+		if event.key() == Qt.Key_Escape or event.key() == Qt.Key_O:
+			self.hide()
+		else:
+			QtWidgets.QListView.keyPressEvent(self, event)
+
+class EventRecorder:
+	# logs the input events of a marking session as json lines, together with the marks of every candidate visited
+	# before and after, so that ReplaySession can feed them back and check it ends up with the same marks
+	eventTypes = {
+		QtCore.QEvent.MouseButtonPress : "mousePress",
+		QtCore.QEvent.MouseButtonDblClick : "mouseDblClick",
+		QtCore.QEvent.MouseMove : "mouseMove",
+		QtCore.QEvent.MouseButtonRelease : "mouseRelease",
+		QtCore.QEvent.KeyPress : "key",
+		QtCore.QEvent.TabletPress : "tabletPress",
+		QtCore.QEvent.TabletMove : "tabletMove",
+		QtCore.QEvent.TabletRelease : "tabletRelease"
+	}
+	
+	replayedTypes = list(eventTypes.values()) + ["wheel", "filter", "resize", "page"]
+	
+	def __init__(self, path):
+		self.file = open(path, "w")
+		self.start = time.perf_counter()
+		self.candidates = {} # name -> dir, of candidates visited
+		
+	def Record(self, entry):
+		entry["t"] = time.perf_counter() - self.start
+		self.file.write(json.dumps(entry) + "\n")
+		
+	def RecordHeader(self, widget):
+		self.Record({"type" : "header", "inputDir" : widget.lastInputDir, "user" : widget.user,
+					"candidate" : widget.curCandidate.name if widget.curCandidate else None, "page" : widget.curCandidatePage,
+					"size" : [widget.width(), widget.height()],
+					"status" : widget.catalog.status if widget.catalog is not None else {}}) # the whole cohort, which question guesses depend on
+		
+	def RecordPage(self, candidate, page, y):
+		# where each navigation landed, as it may depend on candidates that a replay doesn't have
+		self.Record({"type" : "page", "candidate" : candidate.name, "page" : page, "y" : y})
+		
+	def RecordCandidate(self, candidate):
+		if candidate.name in self.candidates:
+			return
+		self.candidates[candidate.name] = candidate.dir
+		with open(os.path.join(candidate.dir, marksFileName), "rb") as f:
+			self.Record({"type" : "initialMarks", "candidate" : candidate.name, "nPages" : len(candidate.marks),
+						"marks" : base64.b64encode(f.read()).decode("ascii")})
+		
+	def RecordEvent(self, event):
+		type = "wheel" if event.type()==QtCore.QEvent.Wheel else self.eventTypes.get(event.type())
+		if not type:
+			return
+		entry = {"type" : type, "modifiers" : int(event.modifiers())}
+		if type=="key":
+			entry["key"] = event.key()
+			entry["text"] = event.text()
+		elif type=="wheel":
+			entry["x"], entry["y"] = event.posF().x(), event.posF().y()
+			entry["angleDelta"] = [event.angleDelta().x(), event.angleDelta().y()]
+		elif type.startswith("mouse"):
+			entry["x"], entry["y"] = event.localPos().x(), event.localPos().y()
+			entry["button"] = int(event.button())
+			entry["buttons"] = int(event.buttons())
+		else: # tablet
+			entry["x"], entry["y"] = event.posF().x(), event.posF().y()
+			entry["pressure"] = event.pressure()
+			entry["device"] = int(event.device())
+			entry["pointerType"] = int(event.pointerType())
+		self.Record(entry)
+		
+	def Close(self):
+		for name, dir in self.candidates.items():
+			with open(os.path.join(dir, marksFileName), "rb") as f:
+				self.Record({"type" : "finalMarks", "candidate" : name, "marks" : base64.b64encode(f.read()).decode("ascii")})
+		self.file.close()
+		self.file = None
+
+def CreateRecordedEvent(entry):
+	# rebuild the Qt event for a recorded entry
+	type = entry["type"]
+	modifiers = QtCore.Qt.KeyboardModifiers(entry["modifiers"])
+	if type=="key":
+		return QtGui.QKeyEvent(QtCore.QEvent.KeyPress, entry["key"], modifiers, entry["text"])
+	pos = QtCore.QPointF(entry["x"], entry["y"])
+	if type=="wheel":
+		angleDelta = QtCore.QPoint(*entry["angleDelta"])
+		return QtGui.QWheelEvent(pos, pos, QtCore.QPoint(), angleDelta, QtCore.Qt.NoButton, modifiers, QtCore.Qt.NoScrollPhase, False)
+	if type.startswith("mouse"):
+		qtype = {"mousePress" : QtCore.QEvent.MouseButtonPress, "mouseDblClick" : QtCore.QEvent.MouseButtonDblClick,
+				"mouseMove" : QtCore.QEvent.MouseMove, "mouseRelease" : QtCore.QEvent.MouseButtonRelease}[type]
+		return QtGui.QMouseEvent(qtype, pos, QtCore.Qt.MouseButton(entry["button"]), QtCore.Qt.MouseButtons(entry["buttons"]), modifiers)
+	qtype = {"tabletPress" : QtCore.QEvent.TabletPress, "tabletMove" : QtCore.QEvent.TabletMove, "tabletRelease" : QtCore.QEvent.TabletRelease}[type]
+	return QtGui.QTabletEvent(qtype, pos, pos, entry["device"], entry["pointerType"], entry["pressure"], 0, 0, 0, 0, 0, modifiers, 0)
+	
+def ReplaySession(path):
+	# feeds a recorded session into a PrettyWidget working on a copy of the recorded candidates, reports
+	# per event type handling latency, and checks the final marks; returns a process exit code, 1 if the final marks differ
+	# and 2 if they match but navigation had to be redirected, as then the recording wasn't faithfully reproduced
+	with open(path, "r") as f:
+		entries = [json.loads(line) for line in f if line.strip()]
+	headers = [entry for entry in entries if entry["type"]=="header"]
+	assert headers, "Not a recorded session: %s" % path
+	header = headers[0]
+	
+	work_dir = tempfile.mkdtemp(prefix="pdf-marker-replay-")
+	input_dir = os.path.join(work_dir, "scripts")
+	internal_dir = os.path.join(input_dir, "_pdf-marker-internal")
+	os.makedirs(internal_dir)
+	src_internal_dir = os.path.join(header["inputDir"], "_pdf-marker-internal")
+	markSchemeTime = None
+	if os.path.exists(os.path.join(header["inputDir"], "fullmarks.json")):
+		shutil.copy(os.path.join(header["inputDir"], "fullmarks.json"), input_dir)
+		markSchemeTime = os.path.getmtime(os.path.join(input_dir, "fullmarks.json"))
+	# the status of every candidate, not just those visited, so that cohort wide guesses come out the same
+	with open(os.path.join(internal_dir, "status.json"), "w") as f:
+		json.dump({"version" : CandidateCatalog.statusVersion, "markScheme" : markSchemeTime, "candidates" : header.get("status", {})}, f)
+	for entry in entries:
+		if entry["type"]=="initialMarks":
+			dir = os.path.join(internal_dir, entry["candidate"])
+			os.mkdir(dir)
+			for i in range(entry["nPages"]):
+				shutil.copy(GetPagePath(os.path.join(src_internal_dir, entry["candidate"]), i), GetPagePath(dir, i))
+			with open(os.path.join(dir, marksFileName), "wb") as f:
+				f.write(base64.b64decode(entry["marks"]))
+	os.environ["PDF_MARKER_USER"] = "replay"
+	with open(os.path.join(work_dir, "config-replay.pickle"), "wb") as f:
+		pickle.dump({"lastInputDir" : input_dir, 
+					"lastCandidateDir" : os.path.join(internal_dir, header["candidate"]) if header["candidate"] else None, 
+					"lastCandidatePage" : header["page"]}, f)
+	
+	widget = PrettyWidget(configDir=work_dir)
+	widget.resize(*header["size"])
+	app = QtWidgets.QApplication.instance()
+	app.processEvents()
+	widget.jobs.Wait()
+	app.processEvents()
+	start = datetime.datetime.now()
+	latencies = collections.defaultdict(list)
+	corrected = 0
+	for entry in entries:
+		type = entry["type"]
+		if type not in EventRecorder.replayedTypes:
+			continue
+		if type=="page":
+			# navigation can depend on candidates that weren't visited, so go where the recording went
+			dir = os.path.join(internal_dir, entry["candidate"])
+			if not widget.curCandidate or widget.curCandidate.dir != dir or widget.curCandidatePage != entry["page"]:
+				if dir not in widget.catalog:
+					widget.catalog.Add(dir)
+				widget.SetCandidatePage(dir, entry["page"], entry["y"])
+				corrected += 1
+			continue
+		if type=="resize":
+			widget.resize(*entry["size"])
+			app.processEvents()
+			continue
+		widget.clock = lambda t=entry["t"]: start + datetime.timedelta(seconds=t)
+		t0 = time.perf_counter()
+		if type=="filter":
+			widget.catalog.SetFilter(entry["text"])
+			widget.UpdatePixmap()
+		elif type=="key" and entry["key"] in (QtCore.Qt.Key_Escape, QtCore.Qt.Key_F):
+			continue # these open dialogs or quit, their outcome is recorded separately
+		elif type=="wheel":
+			widget.wheelEvent(CreateRecordedEvent(entry))
+		else:
+			widget.eventFilter(widget, CreateRecordedEvent(entry))
+		latencies[type].append(time.perf_counter() - t0)
+		app.processEvents()
+	widget.close()
+	
+	if corrected:
+		print("%d page changes went elsewhere than recorded and were redirected" % corrected)
+	print("%-14s %6s %8s %8s %8s %8s" % ("event", "count", "p50 ms", "p90 ms", "p99 ms", "max ms"))
+	for type, times in sorted(latencies.items()):
+		p50, p90, p99 = np.percentile(times, [50, 90, 99]) * 1000
+		print("%-14s %6d %8.2f %8.2f %8.2f %8.2f" % (type, len(times), p50, p90, p99, max(times)*1000))
+	mismatched = []
+	for entry in entries:
+		if entry["type"]=="finalMarks":
+			with open(os.path.join(internal_dir, entry["candidate"], marksFileName), "rb") as f:
+				if f.read() != base64.b64decode(entry["marks"]):
+					mismatched.append(entry["candidate"])
+	shutil.rmtree(work_dir)
+	if mismatched:
+		print("Final marks differ from the recording for: %s" % ", ".join(mismatched))
+		return 1
+	print("Final marks match the recording")
+	return 2 if corrected else 0
+
+class PrettyWidget(QtWidgets.QWidget):
+	def __init__(self, parent=None, configDir=".", recorder=None):
 		QtWidgets.QWidget.__init__(self, parent=parent)
 		self.showMaximized()		
 		self.setWindowTitle('Pdf Marker')
 		self.installEventFilter(self)
+		self.recorder = recorder # EventRecorder, if this session is being recorded
+		self.clock = datetime.datetime.now # replaced when replaying, so that tablet/mouse suppression sees recorded timings
 		
 		self.curCandidate = None # current candidate
 		self.curCandidateDir = None # path, of current candidate
 		self.curCandidatePage = None # integer, current page of candidate
-		self.candidateDirs = []
+		self.catalog = None # CandidateCatalog, once the scripts dir is known
+		self.statusTimer = QtCore.QTimer(self)
+		self.statusTimer.setSingleShot(True)
+		self.statusTimer.setInterval(30*1000)
+		self.statusTimer.timeout.connect(lambda: self.catalog is not None and self.catalog.SaveStatus())
+		self.jobs = JobQueue(self)
+		self.jobs.changed.connect(self.UpdateJobStatus)
+		
+		# several markers can share one scripts dir, each holding a lease on the candidate they are marking
+		self.user = GetUserName()
+		self.lease = None # CandidateLease on the current candidate, held unless it is someone else's
+		self.leaseTimer = QtCore.QTimer(self)
+		self.leaseTimer.timeout.connect(self.RenewLease)
+		self.leaseTimer.start(int(CandidateLease.timeout*1000/3))
 		
-		# config file
+		# config file, one per marker
 		self.lastInputDir = None 
 		self.lastOutputDir = None
 		self.lastCandidateDir = None
 		self.lastCandidatePage = None
-		self.configFile = os.path.join(".","config.pickle")
+		self.watchInput = False # ingest new pdfs as they arrive in lastInputDir
+		self.configFile = os.path.join(configDir,"config-%s.pickle" % self.user)
+		legacyConfigFile = os.path.join(configDir,"config.pickle")
+		if not os.path.exists(self.configFile) and os.path.exists(legacyConfigFile):
+			shutil.copy(legacyConfigFile, self.configFile)
 		self.LoadConfig()
 		
 		self.markScheme = None
 		
-		self.curPixmapBG = None # current page without annotations
+		self.curPageImage = None # current page without annotations, a QImage
+		self.tileCache = TileCache()
+		self.zoom = 1 # magnification over the page fitted to the window
+		self.maxZoom = 8
+		self.viewX = 0 # page coordinates of the top left of the view
+		self.viewY = 0
+		self.panStart = None # screen position of the last middle button drag event, while panning
+		self.overview = None # ThumbnailOverview, once opened
+		self.scriptWatcher = None # ScriptWatcher on lastInputDir, while watchInput is on
+		self.pageCache = PageCache(parent=self)
+		self.questionMode = None # in question-major mode, the (0-based) question being marked across candidates
+		self.prefetchCount = 3 # candidates to prefetch ahead in question-major mode
 		self.curPixMapRatio = 1 # resize ratio of background pixmap to screen space
 		self.marginX = 300 
 				
@@ -234,6 +1637,13 @@ class PrettyWidget(QtWidgets.QWidget):
 		self.outputScriptsButton.clicked.connect(self.OutputScripts)
 		self.outputScriptsButton.show()
 		
+		self.watchScriptsButton = QtWidgets.QPushButton("Watch scripts", self)
+		self.watchScriptsButton.setToolTip("Input new scripts as they arrive in the scripts directory.")
+		self.watchScriptsButton.setCheckable(True)
+		self.watchScriptsButton.move(5,5+self.outputScriptsButton.y()+self.outputScriptsButton.height())		
+		self.watchScriptsButton.toggled.connect(self.SetWatchInput)
+		self.watchScriptsButton.show()
+		
 		self.forwardPageButton = QtWidgets.QPushButton(" > ", self)
 		self.forwardPageButton.setToolTip("go back one page")
 		self.forwardPageButton.clicked.connect(self.ForwardPage)
@@ -245,7 +1655,13 @@ class PrettyWidget(QtWidgets.QWidget):
 		self.progressLB.setAlignment(Qt.AlignLeft)
 		self.progressLB.setStyleSheet("font: 12pt Consolas")
 		self.progressLB.move(10+self.inputScriptsButton.width(),5)
-		self.progressLB.resize(200, self.inputScriptsButton.height())
+		self.progressLB.resize(300, self.inputScriptsButton.height())
+		
+		self.cancelJobsButton = QtWidgets.QPushButton("Cancel", self)
+		self.cancelJobsButton.setToolTip("Cancel the running and queued background jobs.")
+		self.cancelJobsButton.move(self.progressLB.x(), 5+self.progressLB.y()+self.progressLB.height())
+		self.cancelJobsButton.clicked.connect(self.jobs.CancelAll)
+		self.cancelJobsButton.hide()
 		
 		self.imgLB = QtWidgets.QLabel(self)		
 		self.textLB = QtWidgets.QLabel(self)
@@ -254,12 +1670,12 @@ class PrettyWidget(QtWidgets.QWidget):
 	def SaveConfig(self):
 		config = {
 			"lastInputDir" : self.lastInputDir,
-			"lastCandidateDir" : self.curCandidate.dir,
-			"lastCandidatePage" : self.curCandidatePage,
-			"lastOutputDir" : self.lastOutputDir
+			"lastCandidateDir" : self.curCandidate.dir if self.curCandidate else self.lastCandidateDir,
+			"lastCandidatePage" : self.curCandidatePage if self.curCandidate else self.lastCandidatePage,
+			"lastOutputDir" : self.lastOutputDir,
+			"watchInput" : self.watchInput
 		}
-		with open(self.configFile, "wb") as f:
-			pickle.dump(config, f)			
+		ReplaceFile(self.configFile, pickle.dumps(config))
 		logging.debug("Saved config")
 
 	def LoadConfig(self):
@@ -283,6 +1699,7 @@ class PrettyWidget(QtWidgets.QWidget):
 		else:
 			logging.info("Using scripts dir '%s'" % self.lastInputDir)
 			self.LoadCandidateDirs()	
+			self.UpdateScriptWatcher()
 	
 	@QtCore.pyqtSlot()
 	def SetInputDir(self):
@@ -293,18 +1710,25 @@ class PrettyWidget(QtWidgets.QWidget):
 		if not newScriptsDir:
 			return
 		if newScriptsDir != self.lastInputDir:
+			if self.lastInputDir:
+				self.jobs.CancelFor(self.lastInputDir) # they would keep the queue busy with the old dir
 			self.lastInputDir = newScriptsDir
 			self.curCandidate = None
 			self.curCandidatePage = None
+			self.questionMode = None
 		logging.info("Scripts dir is '%s'" % self.lastInputDir)
-		self.InputScripts()
 		self.LoadCandidateDirs()	
+		self.InputScripts()
+		self.UpdateScriptWatcher()
 			
 	def GetInternalDir(self):
 		return os.path.join(self.lastInputDir, "_pdf-marker-internal")
 		
+	def GetMarkSchemeFile(self):
+		return os.path.join(self.lastInputDir, "fullmarks.json")
+		
 	def LoadMarkScheme(self):
-		file = os.path.join(self.lastInputDir, "fullmarks.json")
+		file = self.GetMarkSchemeFile()
 		if os.path.exists(file):
 			try:
 				self.markScheme = MarkScheme(file) 
@@ -316,97 +1740,81 @@ class PrettyWidget(QtWidgets.QWidget):
 		else:
 			logging.info("No mark scheme present")		
 		
-	def ExtractImagesFromPDF(self, filename_pdf):
-		min_width = 128
-		min_height = 16
-		doc = fitz.open(filename_pdf)
-		imageDatas = []
-		for i in range(len(doc)):
-			for img in doc.getPageImageList(i):
-				xref = img[0]
-				_pix = fitz.Pixmap(doc, xref)
-				if _pix.width <= min_width and _pix.height <= min_height:
-					continue
-				if _pix.n < 5: # GRAY or RGB
-					pix = _pix
-				else: # CMYK: convert to RGB
-					pix = fitz.Pixmap(fitz.csRGB, _pix)
-				imageData = pix.getImageData("png")
-				imageDatas.append(imageData)
-		# dedup in case clipped copies are used on successive pdf pages (e.g. to avoid downscaling)
-		dedupImageDatas = []
-		for imageData in imageDatas:
-			if len(dedupImageDatas)==0 or imageData!=dedupImageDatas[-1]:
-				dedupImageDatas.append(imageData)
-		images = []
-		for imageData in dedupImageDatas:
-			image = Image.open(io.BytesIO(imageData))					
-			images.append(image)
-		return images
-		
 	@QtCore.pyqtSlot()
 	def InputScripts(self):
 		logging.info("Input scripts")
-		x_dim, y_dim = (2480,3508) # A4 paper at 300 dpi
 		if not os.path.exists(self.lastInputDir):
 			logging.error("Scripts not found")
 			return
-		if not os.path.exists(self.GetInternalDir()):
-			os.mkdir(self.GetInternalDir())
-		files = glob.glob(os.path.join(self.lastInputDir, "*.pdf"))
-		self.progressLB.show()
-		self.progressLB.setText("Processing... (%d/%d)" % (0, len(files)))
-		QtWidgets.QApplication.processEvents()
-		for i in range(len(files)):
-			filename_pdf = files[i]
-			logging.info("Processing '%s' (%d/%d)" % (filename_pdf, i+1, len(files)))
-			try:
-				candidate_name = os.path.split(filename_pdf)[1][:-4]
-				candidate_dir = os.path.join(self.GetInternalDir(), candidate_name)
-				if os.path.exists(candidate_dir):
-					logging.info("Candidate directory for '%s' already exists, skipping." % filename_pdf)
-					continue
-				else:
-					os.mkdir(candidate_dir)
-				marks = []
-				images = self.ExtractImagesFromPDF(filename_pdf)
-				for j in range(len(images)):
-					marks.append([])
-				with open(os.path.join(candidate_dir, "marks.pickle"), 'wb') as f:
-					pickle.dump(marks, f)
-				candidate = Candidate(candidate_dir)
-				for j in range(len(images)):
-					pixmap = images[j] 
-					w, h = x_dim, int(pixmap.height/pixmap.width*x_dim)
-					pixmap = pixmap.resize((w,h))
-					pixmap.save(candidate.GetPagePath(j), dpi=(300,300))
-			except Exception as e:
-				logging.exception("Failed to input script from  '%s': %s" % (filename_pdf, str(e)))
-				sys.exit()
-			self.progressLB.setText("Processing... (%d/%d)" % (i+1, len(files)))
-			QtWidgets.QApplication.processEvents()
-		logging.info("Done inputting")
-		self.progressLB.hide()		
+		job = Job("Input", IngestScripts, self.lastInputDir, self.GetInternalDir())
+		job.signals.candidateReady.connect(self.AddCandidate)
+		self.SubmitJob(job)
+		
+	@QtCore.pyqtSlot(bool)
+	def SetWatchInput(self, on):
+		self.watchInput = on
+		self.SaveConfig()
+		self.UpdateScriptWatcher()
+		
+	def UpdateScriptWatcher(self):
+		if self.scriptWatcher:
+			self.scriptWatcher.Stop()
+			self.scriptWatcher = None
+		self.watchScriptsButton.blockSignals(True)
+		self.watchScriptsButton.setChecked(self.watchInput)
+		self.watchScriptsButton.blockSignals(False)
+		if self.watchInput and self.lastInputDir and os.path.exists(self.lastInputDir):
+			logging.info("Watching '%s' for new scripts" % self.lastInputDir)
+			self.scriptWatcher = ScriptWatcher(self.lastInputDir, self.GetInternalDir(), parent=self)
+			self.scriptWatcher.ready.connect(self.InputNewScripts)
+			
+	def InputNewScripts(self, files):
+		logging.info("New scripts: %s" % ", ".join(os.path.split(f)[1] for f in files))
+		job = Job("Input", IngestScripts, self.lastInputDir, self.GetInternalDir(), files)
+		job.signals.candidateReady.connect(self.AddCandidate)
+		if self.SubmitJob(job):
+			self.scriptWatcher.MarkSubmitted(files)
+			job.signals.finished.connect(lambda ok, watcher=self.scriptWatcher: watcher.OnFinished(files, ok))
+		# otherwise an input job is running already, these are offered again at the next poll
+		
+	def AddCandidate(self, dir):
+		if self.catalog is None or os.path.dirname(dir) != self.catalog.internalDir:
+			return # scripts dir has changed since the job started
+		self.catalog.Add(dir)
+		if not self.curCandidate:
+			self.SetCandidatePage(dir, 0)
+		else:
+			self.UpdatePixmap()
 	
 	def LoadCandidateDirs(self):
 		self.LoadMarkScheme()
-		self.candidateDirs = glob.glob(os.path.join(self.GetInternalDir(),"*"))
-		if len(self.candidateDirs)==0:
+		if self.catalog is not None:
+			self.catalog.SaveStatus()
+		self.catalog = CandidateCatalog(self.GetInternalDir(), self.markScheme, self.GetMarkSchemeFile())
+		stale = self.catalog.Load()
+		if stale:
+			self.RecheckCandidates(stale)
+		if len(self.catalog)==0:
 			logging.info("No candidates found, you probably need to load the scripts in")
 			return
-		if self.lastCandidateDir and self.lastCandidateDir in self.candidateDirs and self.lastCandidatePage != None:
+		if self.lastCandidateDir and self.lastCandidateDir in self.catalog and self.lastCandidatePage != None:
 			self.SetCandidatePage(self.lastCandidateDir, self.lastCandidatePage)
 		else:
-			self.SetCandidatePage(self.candidateDirs[0], 0)
+			self.SetCandidatePage(self.catalog.dirs[0], 0)
 	
-	def SetCandidatePage(self, dir, n):
-		# ALL page changes go through here
+	def SetCandidatePage(self, dir, n, y=0):
+		# ALL page changes go through here, y is where the top of the view goes when zoomed in
 		logging.debug("Set candidate page: %s %d" % (dir, n))
-		if dir not in self.candidateDirs:
+		if dir not in self.catalog:
 			logging.error("Candidate not found: %s" % (dir))
 			return
 		if not self.curCandidate or dir != self.curCandidate.dir:
-			self.curCandidate = Candidate(dir)
+			self.ClaimCandidate(dir)
+			self.curCandidate = Candidate(dir) # load after claiming, in case another marker just saved it
+			if self.catalog.statusDirty and not self.statusTimer.isActive():
+				self.statusTimer.start() # not on every change of candidate, status.json is large with many candidates
+			if self.recorder:
+				self.recorder.RecordCandidate(self.curCandidate)
 		if n<-1 or n>len(self.curCandidate.marks):
 			logging.error("Attempt to set invalid candidate page: %s, %d" % (self.curCandidate.name, n))
 			return
@@ -414,22 +1822,32 @@ class PrettyWidget(QtWidgets.QWidget):
 		self.SaveConfig()
 		self.LoadConfig()
 		
-		self.curPixmapBG = QtGui.QPixmap(self.curCandidate.GetPagePath(self.curCandidatePage))
+		self.curPageImage = self.pageCache.Get(self.curCandidate.GetPagePath(self.curCandidatePage))
+		self.viewY = y
+		if self.recorder:
+			self.recorder.RecordPage(self.curCandidate, self.curCandidatePage, y)
 		self.UpdatePixmap()
 		
 	def UpdatePixmap(self):
-		if not self.curPixmapBG:
+		if not self.curPageImage or not self.curCandidate:
 			return		
 		logging.debug("Pixmap update")
 		self.SetGeometry()
-		pixmap = self.CreatePixmap(self.curPixmapBG, self.curCandidate.marks[self.curCandidatePage])	
-		
-		self.imgLB.setPixmap(pixmap.scaled(self.imgLB.size(), QtCore.Qt.IgnoreAspectRatio, transformMode=QtCore.Qt.SmoothTransformation))	
+		self.ClampView()
+		self.RenderView()
 		self.imgLB.show()	
 		
 		label_text = "Filename: %s \n" % (self.curCandidate.name)
-		label_text += "Candidate: %d/%d \n" % (self.candidateDirs.index(self.curCandidate.dir)+1, len(self.candidateDirs))
-		label_text += "Page: %d/%d \n\n\n" % (self.curCandidatePage+1, len(self.curCandidate.marks))	
+		viewPosition = self.catalog.ViewPosition(self.curCandidate.dir)
+		label_text += "Candidate: %s/%d \n" % ("-" if viewPosition is None else viewPosition+1, len(self.catalog.view))
+		if self.catalog.filter[0] != "all":
+			label_text += "Filter: %s (%d total)\n" % (self.catalog.GetFilterText(), len(self.catalog))
+		if self.questionMode is not None:
+			label_text += "Marking Q%d for all candidates\n" % (self.questionMode+1)
+		label_text += "Page: %d/%d \n" % (self.curCandidatePage+1, len(self.curCandidate.marks))	
+		if self.zoom != 1:
+			label_text += "Zoom: %gx\n" % self.zoom
+		label_text += "Read only, being marked by %s\n\n" % CandidateLease.GetHolder(self.curCandidate.dir) if not self.lease.held else "\n\n"
 		if self.markScheme:
 			_, score, part_score_str, status = self.curCandidate.CheckMarks(self.markScheme)
 			label_text += "Score: %d/%d = %0.f%%\n" % (score, self.markScheme.nFullMarks, 100*score/self.markScheme.nFullMarks)
@@ -443,12 +1861,12 @@ class PrettyWidget(QtWidgets.QWidget):
 		x_window = self.geometry().width()
 		y_window = self.geometry().height()
 		if x_window > 1.5*y_window: # landscape
-			x_ratio = float(x_window*0.5) / float(self.curPixmapBG.width())
-			y_ratio = float(y_window*0.99) / float(self.curPixmapBG.height())
+			x_ratio = float(x_window*0.5) / float(self.curPageImage.width())
+			y_ratio = float(y_window*0.99) / float(self.curPageImage.height())
 			ratio = min(x_ratio, y_ratio)
 			self.curPixMapRatio = ratio
-			x_img = self.curPixmapBG.width() * ratio
-			y_img = self.curPixmapBG.height() * ratio	
+			x_img = self.curPageImage.width() * ratio
+			y_img = self.curPageImage.height() * ratio	
 			self.imgLB.resize(int(x_img), int(y_img))
 			self.imgLB.move(int((x_window - x_img) / 2),int((y_window - y_img) / 2))
 			self.textLB.resize(int(x_window*0.25), int(y_window*0.6))
@@ -458,12 +1876,12 @@ class PrettyWidget(QtWidgets.QWidget):
 			self.textLB.setText(self.textLB.text())
 			self.textLB.show() 
 		else: #portrait
-			x_ratio = float(x_window*0.9) / float(self.curPixmapBG.width())
-			y_ratio = float(y_window*0.88) / float(self.curPixmapBG.height())
+			x_ratio = float(x_window*0.9) / float(self.curPageImage.width())
+			y_ratio = float(y_window*0.88) / float(self.curPageImage.height())
 			ratio = min(x_ratio, y_ratio)
 			self.curPixMapRatio = ratio
-			x_img = self.curPixmapBG.width() * ratio
-			y_img = self.curPixmapBG.height() * ratio	
+			x_img = self.curPageImage.width() * ratio
+			y_img = self.curPageImage.height() * ratio	
 			self.imgLB.resize(int(x_img), int(y_img))
 			self.imgLB.move(int((x_window - x_img) / 2),int((y_window - y_img) * 9/10))
 			self.textLB.hide()				
@@ -476,70 +1894,59 @@ class PrettyWidget(QtWidgets.QWidget):
 		self.forwardPageButton.resize(w, h*2)
 		self.forwardPageButton.show()
 
-	def CreatePixmap(self, backgroundPixmap, marks):
-		# overlay marks onto background
-		pixmap = QtGui.QPixmap(backgroundPixmap.width(), backgroundPixmap.height())
-		pixmap.fill(QtCore.Qt.transparent)
-		marksPixmap = self.CreateMarksPixMap(backgroundPixmap, marks)	
-		canvasPainter = QtGui.QPainter(pixmap)
-		canvasPainter.setRenderHint(QtGui.QPainter.Antialiasing)
-		canvasPainter.setCompositionMode(QtGui.QPainter.CompositionMode_SourceOver)	
-		canvasPainter.drawPixmap(pixmap.rect(), backgroundPixmap)
-		canvasPainter.drawPixmap(pixmap.rect(), marksPixmap)
-		canvasPainter.end()
-		return pixmap
-			
-	def CreateMarksPixMap(self, pixmap_bg, marks):
-		# create a pixmap with just the marks (no background image)
-		pixmap = QtGui.QPixmap(pixmap_bg.width(), pixmap_bg.height())
-		pixmap.fill(QtCore.Qt.transparent)
+	def ViewScale(self):
+		# screen pixels per page pixel
+		return self.curPixMapRatio * self.zoom
+		
+	def ScreenToPage(self, x, y):
+		# (x,y) relative to imgLB, in page coordinates
+		scale = self.ViewScale()
+		return self.viewX + x/scale, self.viewY + y/scale
+		
+	def ClampView(self):
+		scale = self.ViewScale()
+		self.viewX = max(0, min(self.viewX, self.curPageImage.width() - self.imgLB.width()/scale))
+		self.viewY = max(0, min(self.viewY, self.curPageImage.height() - self.imgLB.height()/scale))
+		
+	def RenderView(self):
+		# compose the visible part of the page from tiles, drawing only those not already in the tile cache
+		scale = self.ViewScale()
+		T = self.tileCache.tileSize
+		page = self.curCandidatePage
+		marks = self.curCandidate.marks[page]
+		marginX = self.marginX if self.markScheme else None
+		left, top = self.viewX*scale, self.viewY*scale # in tile pixels
+		pixmap = QtGui.QPixmap(self.imgLB.size())
+		pixmap.fill(Qt.white)
 		painter = QtGui.QPainter(pixmap)
-		painter.setRenderHint(QtGui.QPainter.Antialiasing, True)
-		painter.setCompositionMode(QtGui.QPainter.CompositionMode_SourceOver)	
-		painter.setPen(QtGui.QPen(Qt.red,  4, Qt.SolidLine))
-		# mark types: strike, score, tally, justify, circle, leftarrow, rightarrow
-		for mark in marks:
-			if mark.type=="strike":
-				painter.setOpacity(0.5)
-				w = pixmap_bg.width() 
-				h = pixmap_bg.height()
-				painter.drawLine(int(w/2/0.9), int(h*0.02), int(w/2*0.9), int(h*0.98))								
-				painter.setOpacity(1)
-			elif mark.type=="circle":
-				painter.drawEllipse(int(mark.x-mark.w/2), int(mark.y-mark.h/2), int(mark.w), int(mark.h))
-			elif mark.type=="justify":
-				painter.setFont(QtGui.QFont("sanserif", int(mark.h*0.5)))
-				rect = QtCore.QRect(int(mark.x-mark.w/2), int(mark.y-mark.h/2), int(mark.w), int(mark.h))
-				painter.drawText(rect, Qt.AlignCenter, "justify")			
-			elif mark.type=="score" or mark.type=="tally":
-				painter.setFont(QtGui.QFont("sanserif", int(mark.h*0.8)))
-				rect = QtCore.QRect(int(mark.x-mark.w/2), int(mark.y-mark.h/2), int(mark.w), int(mark.h))
-				painter.drawText(rect, Qt.AlignCenter, str(int(mark.score)))
-				if mark.type=="tally":
-					painter.drawRect(rect)
-			elif mark.type=="leftarrow":
-				painter.drawLine(int(mark.x-mark.w/2), mark.y, int(mark.x+mark.w/2), int(mark.y))
-				painter.drawLine(int(mark.x-mark.w/2+mark.h/4), int(mark.y-mark.h/4), int(mark.x-mark.w/2), int(mark.y))
-				painter.drawLine(int(mark.x-mark.w/2+mark.h/4), int(mark.y+mark.h/4), int(mark.x-mark.w/2), int(mark.y))
-			elif mark.type=="rightarrow":
-				painter.drawLine(int(mark.x-mark.w/2), mark.y, int(mark.x+mark.w/2), int(mark.y))
-				painter.drawLine(int(mark.x+mark.w/2-mark.h/4), int(mark.y-mark.h/4), int(mark.x+mark.w/2), int(mark.y))
-				painter.drawLine(int(mark.x+mark.w/2-mark.h/4), int(mark.y+mark.h/4), int(mark.x+mark.w/2), int(mark.y))
-			elif mark.type=="touch":
-				painter.setPen(QtGui.QPen(Qt.red,  self.tabletPenSize, Qt.SolidLine, Qt.RoundCap, Qt.RoundJoin))
-				for i in range(len(mark.posList)-1):
-					x1 = mark.posList[i].x()
-					y1 = mark.posList[i].y()
-					x2 = mark.posList[i+1].x()
-					y2 = mark.posList[i+1].y()
-					painter.drawLine(int(x1), int(y1), int(x2), int(y2))
-				painter.setPen(QtGui.QPen(Qt.red,  4, Qt.SolidLine))
-		# margin		
-		if self.markScheme:
-			painter.setPen(QtGui.QPen(Qt.red,  4, Qt.DashLine))
-			painter.drawLine(self.marginX, 0, self.marginX, int(self.height()/self.curPixMapRatio))
+		for ty in range(int(top//T), int((top+self.imgLB.height()-1)//T)+1):
+			for tx in range(int(left//T), int((left+self.imgLB.width()-1)//T)+1):
+				key = (self.curCandidate.serial, page, self.curCandidate.pageVersions[page], round(scale, 6), marginX, tx, ty)
+				tile = self.tileCache.Get(key, lambda: RenderTile(self.curPageImage, marks, scale, tx, ty, T, self.tabletPenSize, marginX))
+				painter.drawPixmap(round(tx*T-left), round(ty*T-top), tile)
 		painter.end()
-		return pixmap
+		self.imgLB.setPixmap(pixmap)
+		
+	def SetZoom(self, zoom, x=None, y=None):
+		# keeps the page point at (x,y) relative to imgLB still, by default the centre of the view
+		if not self.curPageImage:
+			return
+		x = self.imgLB.width()/2 if x is None else x
+		y = self.imgLB.height()/2 if y is None else y
+		page_x, page_y = self.ScreenToPage(x, y)
+		self.zoom = max(1, min(zoom, self.maxZoom))
+		scale = self.ViewScale()
+		self.viewX = page_x - x/scale
+		self.viewY = page_y - y/scale
+		self.UpdatePixmap()
+		
+	def Pan(self, dx, dy):
+		# move the page by (dx,dy) screen pixels
+		scale = self.ViewScale()
+		self.viewX -= dx/scale
+		self.viewY -= dy/scale
+		self.ClampView()
+		self.RenderView()
 
 	@QtCore.pyqtSlot()
 	def ForwardPage(self):
@@ -550,27 +1957,36 @@ class PrettyWidget(QtWidgets.QWidget):
 		self.IncrementPage(-1, False)
 	
 	def eventFilter(self, obj, event):
-		if event.type() == QtCore.QEvent.MouseButtonPress:	
-			if self.tabletPainter or datetime.datetime.now()-self.lastTabletEventTime < datetime.timedelta(seconds=0.1): 
+		if self.recorder and event.type() != QtCore.QEvent.Wheel: # recorded in wheelEvent
+			self.recorder.RecordEvent(event)
+		if event.type() in (QtCore.QEvent.MouseButtonPress, QtCore.QEvent.MouseButtonDblClick) and event.button() == Qt.MiddleButton:
+			self.panStart = event.pos() # drag to pan, a quick second press arrives as a double click
+		elif event.type() == QtCore.QEvent.MouseMove and self.panStart is not None:
+			self.Pan(event.pos().x()-self.panStart.x(), event.pos().y()-self.panStart.y())
+			self.panStart = event.pos()
+		elif event.type() == QtCore.QEvent.MouseButtonRelease and event.button() == Qt.MiddleButton:
+			self.panStart = None
+		elif event.type() == QtCore.QEvent.MouseButtonPress:	
+			if self.tabletPainter or self.clock()-self.lastTabletEventTime < datetime.timedelta(seconds=0.1): 
 				logging.debug("Suppressed QEvent.MouseButtonPress")
 				return True # some QEvent.TabletPress get duplicatedsd as QEvent.MouseButtonPress >_>
 			self.MousePressEvent(event)
 		elif event.type() == QtCore.QEvent.MouseButtonDblClick:
-			if self.tabletPainter or datetime.datetime.now()-self.lastTabletEventTime < datetime.timedelta(seconds=0.1): 
+			if self.tabletPainter or self.clock()-self.lastTabletEventTime < datetime.timedelta(seconds=0.1): 
 				logging.debug("Suppressed QEvent.MouseButtonDblClick")
 				return True 
 			self.MousePressEvent(event)		
 		elif event.type() == QtCore.QEvent.KeyPress:	
 			self.KeyPressEvent(event)
 		elif event.type() == QtCore.QEvent.TabletPress:	
-			self.lastTabletEventTime = datetime.datetime.now()
+			self.lastTabletEventTime = self.clock()
 			self.tabletControl = True
 			self.TabletPressEvent(event)
 		elif event.type() == QtCore.QEvent.TabletMove:	 
-			self.lastTabletEventTime = datetime.datetime.now()
+			self.lastTabletEventTime = self.clock()
 			self.TabletMoveEvent(event)
 		elif event.type() == QtCore.QEvent.TabletRelease:	
-			self.lastTabletEventTime = datetime.datetime.now()
+			self.lastTabletEventTime = self.clock()
 			self.tabletControl = False
 			self.TabletReleaseEvent(event)
 		else:
@@ -581,13 +1997,13 @@ class PrettyWidget(QtWidgets.QWidget):
 		# touch marks are drawn here in screen space, then converted to underlying image size in TabletReleaseEvent
 		x = event.x() - self.imgLB.x()
 		y = event.y() - self.imgLB.y()
-		if x >= self.imgLB.width() or y >= self.imgLB.height():
+		if x >= self.imgLB.width() or y >= self.imgLB.height() or not self.CanEdit():
 			return True
 		self.tabletPainter = QtGui.QPainter(self.imgLB.pixmap())
 		self.tabletPainter.setRenderHint(QtGui.QPainter.Antialiasing, True)
 		self.tabletPainter.setCompositionMode(QtGui.QPainter.CompositionMode_SourceOver)	
 		pen_size = max(1, int(min(self.imgLB.height(), self.imgLB.width())/300)) # magic
-		self.tabletPainter.setPen(QtGui.QPen(Qt.red, self.tabletPenSize*self.curPixMapRatio, Qt.SolidLine, Qt.RoundCap, Qt.RoundJoin))
+		self.tabletPainter.setPen(QtGui.QPen(Qt.red, self.tabletPenSize*self.ViewScale(), Qt.SolidLine, Qt.RoundCap, Qt.RoundJoin))
 		self.tabletEventPosList = [QtCore.QPointF(x,y)] # list for possible future use e.g bezier
 		logging.debug("Tablet painter is on")
 	
@@ -610,14 +2026,14 @@ class PrettyWidget(QtWidgets.QWidget):
 		self.tabletPainter.end()
 		self.tabletPainter = None
 		logging.debug("Tablet painter is off")
-		mark = Mark("touch", -1, -1, -1, -1, None, self.ScaleEventList(self.tabletEventPosList))
-		self.curCandidate.marks[self.curCandidatePage].append(mark)
+		mark = Mark(Mark.TOUCH, -1, -1, -1, -1, None, self.ScaleEventList(self.tabletEventPosList))
+		self.curCandidate.AddMark(self.curCandidatePage, mark)
 		logging.debug("Added touch mark, first pos (%f,%f)" % (self.tabletEventPosList[0].x(), self.tabletEventPosList[0].y()))
 		self.tabletEventPosList = None
 		self.UpdatePixmap()
 		
 	def ScaleEventList(self, l):
-		return [QtCore.QPointF(p.x()/self.curPixMapRatio,p.y()/self.curPixMapRatio) for p in l]	
+		return np.array([self.ScreenToPage(p.x(), p.y()) for p in l], dtype=np.float32)
 	
 	def MousePressEvent(self, event):
 		global_x = event.pos().x()
@@ -626,15 +2042,17 @@ class PrettyWidget(QtWidgets.QWidget):
 		y = global_y - self.imgLB.y()
 		if x >= self.imgLB.width() or y >= self.imgLB.height() or x<0 or y<0:
 			return
-		x /= self.curPixMapRatio
-		y /= self.curPixMapRatio
+		if event.button() not in (1, 2, 8, 16): # left, right, backwards, forward mouse; other buttons must not remove the mark under them
+			return
+		if not self.CanEdit():
+			return
+		x, y = self.ScreenToPage(x, y)
 		x = int(x)
 		y = int(y)
 		margin = self.markScheme and (x <= self.marginX)  
 		if margin:
 			x = self.marginX/2
-		marks = self.curCandidate.marks[self.curCandidatePage]
-		mark = self.ExtractMarkAtLoc(x,y, marks)
+		mark = self.ExtractMarkAtLoc(x,y)
 		old_mark = mark
 		shift = (event.modifiers() == QtCore.Qt.ShiftModifier)
 		scale = self.marginX # ugh, but its not so silly
@@ -643,23 +2061,23 @@ class PrettyWidget(QtWidgets.QWidget):
 			if margin:			
 				if event.button()==1: # left mouse
 					count = 5 if shift else 1
-					mark = Mark("score", x, y, scale/3*1.25, scale/3, count)
+					mark = Mark(Mark.SCORE, x, y, scale/3*1.25, scale/3, count)
 				elif event.button()==2: # right mouse
-					mark = Mark("score", x, y, scale/3*1.25, scale/3, 0)
+					mark = Mark(Mark.SCORE, x, y, scale/3*1.25, scale/3, 0)
 				elif event.button()==8: # backwards mouse
-					mark = Mark("tally", x, y, scale/3*1.25, scale/3, -1)
+					mark = Mark(Mark.TALLY, x, y, scale/3*1.25, scale/3, -1)
 			else:
 				if event.button()==1: # left mouse
-					mark = Mark("circle", x, y, scale/3, scale/3)
+					mark = Mark(Mark.CIRCLE, x, y, scale/3, scale/3)
 				elif event.button()==2: # right mouse
 					self.ToggleStrike()
 				elif event.button()==8: # backwards mouse
-					mark = Mark("justify", x, y, scale/2, scale/3.5)
+					mark = Mark(Mark.JUSTIFY, x, y, scale/2, scale/3.5)
 				elif event.button()==16: # forward mouse
-					mark = Mark("rightarrow", x, y, scale/2, scale/3)
+					mark = Mark(Mark.RIGHTARROW, x, y, scale/2, scale/3)
 		else:
 			# mark exists here already
-			if margin and mark.type=="score":			
+			if margin and mark.type==Mark.SCORE:			
 				count = 5 if shift else 1
 				if event.button()==1: # left mouse
 					mark.score += count
@@ -668,7 +2086,7 @@ class PrettyWidget(QtWidgets.QWidget):
 					if mark.score<0:
 						mark = None
 			else:
-				if mark.type=="circle":
+				if mark.type==Mark.CIRCLE:
 					incr_scale = 2
 					if event.button()==1: # left mouse
 						mark.h *= incr_scale
@@ -678,52 +2096,59 @@ class PrettyWidget(QtWidgets.QWidget):
 						mark.w /= incr_scale
 						if mark.h<=150 or mark.w<=150:
 							mark = None
-				elif mark.type=="leftarrow" and event.button()==16:
-					mark = Mark("rightarrow", x, y, scale/2, scale/3)
-				elif mark.type=="rightarrow" and event.button()==16:
-					mark = Mark("leftarrow", x, y, scale/2, scale/3)
+				elif mark.type==Mark.LEFTARROW and event.button()==16:
+					mark = Mark(Mark.RIGHTARROW, x, y, scale/2, scale/3)
+				elif mark.type==Mark.RIGHTARROW and event.button()==16:
+					mark = Mark(Mark.LEFTARROW, x, y, scale/2, scale/3)
 				else:
 					mark = None
 		if mark:
-			marks.append(mark)		
+			self.curCandidate.AddMark(self.curCandidatePage, mark)
 		if mark:
 			if old_mark: logging.debug("Modified mark: %s -> %s" % (old_mark,mark))
 			else: logging.debug("Added mark: %s" % mark)
 		else:
 			if old_mark: logging.debug("Removed mark: %s" % old_mark)
 		self.curCandidate.TallyMarks()
-		self.curCandidate.SaveMarks()
+		self.SaveMarks()
 		self.UpdatePixmap()		
 		
 	def IsMarkAtLoc(self, mark, x, y):
-		if mark.type=="strike":
+		if mark.type==Mark.STRIKE:
 			return False
 		hit = False
-		if mark.type=="circle":
+		if mark.type==Mark.CIRCLE:
 			hit = ((mark.x-x)**2 + (mark.y-y)**2 <= (mark.h/2)**2)
-		elif mark.type=="touch":
-			for p in mark.posList:
-				r = 30 # magic
-				if (x-p.x())**2 + (y-p.y())**2 <= r**2:
-					hit = True
-					break
+		elif mark.type==Mark.TOUCH:
+			r = 30 # magic
+			hit = bool(np.any(np.sum((mark.posList - (x,y))**2, axis=1) <= r**2))
 		else:
 			hit = (abs(mark.x-x)<mark.h/2 and abs(mark.y-y)<mark.w/2)
 		return hit
 		
-	def ExtractMarkAtLoc(self, x,y, marks):
-		# get the (first) mark covering (x,y)
-		_mark = None
+	def ExtractMarkAtLoc(self, x,y):
+		# get the (first) mark covering (x,y), and remove it from the current page
+		marks = self.curCandidate.marks[self.curCandidatePage]
 		for i in range(len(marks)):
-			mark = marks[i]
-			if self.IsMarkAtLoc(mark, x, y):
-				_mark = mark
-				del marks[i]
-				return _mark	
+			if self.IsMarkAtLoc(marks[i], x, y):
+				return self.curCandidate.RemoveMark(self.curCandidatePage, i)
 	
 	def wheelEvent(self, event):
+		if self.recorder:
+			self.recorder.RecordEvent(event)
 		y = event.angleDelta().y()
-		self.IncrementPage(-1 if y>0 else 1, False)
+		if event.modifiers() == QtCore.Qt.ControlModifier:
+			pos = event.posF()
+			self.SetZoom(self.zoom*(1.25 if y>0 else 0.8), pos.x()-self.imgLB.x(), pos.y()-self.imgLB.y())
+		elif self.zoom > 1 and self.curPageImage and self.curCandidate:
+			# scroll within the page, turning the page once at its top or bottom
+			viewY = self.viewY
+			self.Pan(0, y/120*self.imgLB.height()/4)
+			if self.viewY == viewY:
+				# turning back lands at the bottom of the previous page, ClampView brings y into range
+				self.IncrementPage(-1 if y>0 else 1, False, y=float("inf") if y>0 else 0)
+		else:
+			self.IncrementPage(-1 if y>0 else 1, False)
 		
 	def KeyPressEvent(self, event):
 		key = event.key()		
@@ -738,18 +2163,112 @@ class PrettyWidget(QtWidgets.QWidget):
 			self.IncrementPage(-step, shift)
 		elif key == QtCore.Qt.Key_W:
 			self.SkipToFirstUncheckedCandidate()
-		elif key == QtCore.Qt.Key_S:
+		elif key == QtCore.Qt.Key_Q:
+			self.ToggleQuestionMode()
+		elif key == QtCore.Qt.Key_Up:
+			self.SetQuestion(-1)
+		elif key == QtCore.Qt.Key_Down:
+			self.SetQuestion(1)
+		elif key == QtCore.Qt.Key_N:
+			self.SkipToNextUnclaimedCandidate()
+		elif key == QtCore.Qt.Key_S and self.CanEdit():
 			self.ToggleStrike()
-			self.curCandidate.SaveMarks()
+			self.SaveMarks()
 			self.UpdatePixmap()
 		elif key == QtCore.Qt.Key_C:
 			self.ClearCurrentPage()
+		elif key == QtCore.Qt.Key_F:
+			self.SetCandidateFilter()
+		elif key == QtCore.Qt.Key_R and self.catalog is not None:
+			self.RecheckCandidates(list(self.catalog.dirs))
+		elif key == QtCore.Qt.Key_O:
+			self.ShowOverview(shift)
+		elif key == QtCore.Qt.Key_Plus or key == QtCore.Qt.Key_Equal:
+			self.SetZoom(self.zoom*2)
+		elif key == QtCore.Qt.Key_Minus:
+			self.SetZoom(self.zoom/2)
+		elif key == QtCore.Qt.Key_0:
+			self.SetZoom(1)
 	
-	def ClearCurrentPage(self):
+	def ClaimCandidate(self, dir):
+		if self.lease:
+			self.lease.Release()
+		self.lease = CandidateLease(dir, self.user)
+		if not self.lease.Acquire():
+			logging.warning("'%s' is being marked by %s, opening read only" % (os.path.split(dir)[-1], CandidateLease.GetHolder(dir)))
+		self.SaveSession(dir)
+		
+	def RenewLease(self):
+		if self.lease:
+			self.lease.Renew()
+			if self.curCandidate:
+				self.SaveSession(self.curCandidate.dir)
+				
+	def GetSessionFile(self):
+		return os.path.join(self.GetInternalDir(), "_sessions", "%s.json" % self.user)
+		
+	def SaveSession(self, dir):
+		# lets markers see who is working where
+		path = self.GetSessionFile()
+		if not os.path.exists(os.path.dirname(path)):
+			os.makedirs(os.path.dirname(path), exist_ok=True)
+		ReplaceFile(path, json.dumps({"user" : self.user, "candidate" : os.path.split(dir)[-1], "heartbeat" : time.time()}))
+		
+	def CanEdit(self):
 		if not self.curCandidate:
+			return False
+		if self.lease.held:
+			self.lease.Renew() # the lease may have been taken over since the timer last renewed it, e.g. across a sleep
+			if not self.lease.held:
+				self.UpdatePixmap()
+		if not self.lease.held:
+			logging.info("Read only, '%s' is being marked by %s" % (self.curCandidate.name, CandidateLease.GetHolder(self.curCandidate.dir)))
+		return self.lease.held
+		
+	def SkipToNextUnclaimedCandidate(self):
+		if self.catalog is None or not self.curCandidate:
+			return
+		for attempt in range(10): # another marker may claim it between us looking and claiming
+			dir = self.catalog.NextUnclaimed(self.curCandidate.dir, self.user)
+			if not dir:
+				logging.info("No unclaimed incomplete candidates left")
+				return
+			self.SetCandidatePage(dir, 0)
+			if self.lease.held:
+				return
+		
+	def SaveMarks(self):
+		if not self.CanEdit():
+			logging.warning("Not saving marks for '%s', the lease on it has been lost" % self.curCandidate.name)
 			return
-		self.curCandidate.marks[self.curCandidatePage] = []
 		self.curCandidate.SaveMarks()
+		self.catalog.UpdateStatus(self.curCandidate)
+		
+	def SetCandidateFilter(self):
+		if self.catalog is None:
+			return
+		text, ok = QtWidgets.QInputDialog.getText(self, "Filter candidates", 
+					"Show only: incomplete, unstarted, complete, strokes, score <min> <max>, name <text>\n(leave empty for all)",
+					text=self.catalog.GetFilterText())
+		if not ok:
+			return
+		try:
+			self.catalog.SetFilter(text)
+		except ValueError as e:
+			logging.error(str(e))
+			return
+		if self.recorder:
+			self.recorder.Record({"type" : "filter", "text" : text})
+		if self.catalog.ViewPosition(self.curCandidate.dir) is None and self.catalog.view:
+			self.SetCandidatePage(self.catalog.First(), 0)
+		else:
+			self.UpdatePixmap()
+	
+	def ClearCurrentPage(self):
+		if not self.CanEdit():
+			return
+		self.curCandidate.ClearPage(self.curCandidatePage)
+		self.SaveMarks()
 		self.UpdatePixmap()
 		logging.debug("Removed all marks on current page")
 	
@@ -758,46 +2277,126 @@ class PrettyWidget(QtWidgets.QWidget):
 		strike_idx = None
 		for i in range(len(marks)):
 			mark = marks[i]
-			if mark.type=="strike":
+			if mark.type==Mark.STRIKE:
 				strike_idx = i
 				break
 		if strike_idx != None:
-			del marks[strike_idx]
+			self.curCandidate.RemoveMark(self.curCandidatePage, strike_idx)
 		else:
-			marks.append(Mark("strike",-1,-1,-1,-1))
+			self.curCandidate.AddMark(self.curCandidatePage, Mark(Mark.STRIKE,-1,-1,-1,-1))
 		logging.debug("Strike toggled, state=%r" % (strike_idx==None))
 
-	def IncrementPage(self, step, per_candidate, candidate_first_page=True):
+	def IncrementPage(self, step, per_candidate, candidate_first_page=True, y=0):
+		if not self.curCandidate: # e.g. no scripts in yet
+			return
 		if per_candidate:
-			target_idx = self.candidateDirs.index(self.curCandidate.dir) + step
-			target_idx = np.clip(target_idx, 0, len(self.candidateDirs)-1)
-			dir = self.candidateDirs[target_idx]
+			dir = self.catalog.Step(self.curCandidate.dir, step)
 			if dir != self.curCandidate.dir: # don't reset candidatePage to 0 at top-most end
-				candidatePage = 0 if candidate_first_page else -1
-				self.SetCandidatePage(dir, candidatePage)
+				candidateY = y
+				if self.questionMode is not None:
+					candidatePage, candidateY = self.catalog.GetQuestionStart(dir, self.questionMode)
+				else:
+					candidatePage = 0 if candidate_first_page else -1
+				self.SetCandidatePage(dir, candidatePage, candidateY)
+				if self.questionMode is not None:
+					self.PrefetchQuestion(1 if step > 0 else -1)
 			return
 		target_page = self.curCandidatePage + step
 		if target_page<0:
-			self.IncrementPage(-1, True, False)
+			self.IncrementPage(-1, True, False, y)
 			return
 		elif target_page>=len(self.curCandidate.marks):
-			self.IncrementPage(1, True, True)
+			self.IncrementPage(1, True, True, y)
 			return
-		self.SetCandidatePage(self.curCandidate.dir, target_page)
+		self.SetCandidatePage(self.curCandidate.dir, target_page, y)
+		
+	def ToggleQuestionMode(self):
+		if self.questionMode is not None or not self.curCandidate:
+			self.questionMode = None
+			logging.info("Question-major marking off")
+		else:
+			# start with the question on the current page
+			q = sum(1 for i in range(self.curCandidatePage) for mark in self.curCandidate.marks[i] if mark.type==Mark.TALLY)
+			if self.markScheme:
+				q = min(q, len(self.markScheme.qs_max)-1)
+			self.questionMode = q
+			logging.info("Question-major marking on, Q%d" % (q+1))
+			self.PrefetchQuestion(1)
+		self.UpdatePixmap()
+		
+	def SetQuestion(self, step):
+		if self.questionMode is None or not self.curCandidate:
+			return
+		q = max(0, self.questionMode + step)
+		if self.markScheme:
+			q = min(q, len(self.markScheme.qs_max)-1)
+		self.questionMode = q
+		self.SetCandidatePage(self.curCandidate.dir, *self.catalog.GetQuestionStart(self.curCandidate.dir, q))
+		self.PrefetchQuestion(1)
 		
+	def PrefetchQuestion(self, step):
+		# load the pages holding the current question for the next few candidates
+		dir = self.curCandidate.dir
+		for i in range(self.prefetchCount):
+			next_dir = self.catalog.Step(dir, step)
+			if next_dir == dir:
+				break
+			dir = next_dir
+			page = self.catalog.GetQuestionStart(dir, self.questionMode)[0]
+			self.pageCache.Prefetch(GetPagePath(dir, page))
+			
+	def ShowOverview(self, cohort=False):
+		# thumbnails of every page of the current candidate, or of every candidate in the current view
+		if self.catalog is None or not self.curCandidate:
+			return
+		if self.overview is None or self.overview.model().catalog is not self.catalog:
+			if self.overview:
+				self.overview.model().Wait()
+				self.overview.close()
+			model = ThumbnailModel(self.catalog, penSize=self.tabletPenSize, marginX=self.marginX if self.markScheme else None, 
+						checkStrikes=bool(self.markScheme), parent=self)
+			self.overview = ThumbnailOverview(model, self)
+			self.overview.pageSelected.connect(self.SetCandidatePage)
+			self.overview.resize(int(self.width()*0.8), int(self.height()*0.8))
+		dirs = [self.catalog.dirs[i] for i in self.catalog.view] if cohort else [self.curCandidate.dir]
+		cells = []
+		for dir in dirs:
+			status = self.catalog.GetStatus(dir)
+			nPages = status["nPages"] if status else len(glob.glob(os.path.join(dir, "*.jpg")))
+			cells += [(dir, i) for i in range(nPages)]
+		model = self.overview.model()
+		model.SetCells(cells)
+		self.overview.setWindowTitle("All candidates (%s)" % self.catalog.GetFilterText() if cohort else self.curCandidate.name)
+		self.overview.show()
+		self.overview.raise_()
+		cell = (self.curCandidate.dir, self.curCandidatePage)
+		if cell in model.rows:
+			index = model.index(model.rows[cell])
+			self.overview.setCurrentIndex(index)
+			self.overview.scrollTo(index, QtWidgets.QAbstractItemView.PositionAtCenter)
+			
 	def SkipToFirstUncheckedCandidate(self):
 		if not self.markScheme:
 			return True
-		for dir in self.candidateDirs:
-			candidate = Candidate(dir)
-			good, _,_,_ = candidate.CheckMarks(self.markScheme)
-			if not good:
+		for dir in self.catalog.dirs:
+			if self.catalog.IsStale(dir): # a recheck may still be running, or another marker may have changed it
+				try:
+					self.catalog.UpdateStatus(Candidate(dir))
+				except ValueError as e:
+					logging.error(str(e))
+					return False
+			status = self.catalog.GetStatus(dir)
+			if not status or not status["complete"]:
 				self.SetCandidatePage(dir, 0)
 				return False
 		return True				
 	
 	@QtCore.pyqtSlot()
 	def OutputScripts(self):
+		if self.catalog is None:
+			return
+		if self.curCandidate and self.lease.held:
+			self.SaveMarks()
 		# check
 		if self.markScheme:
 			if not self.SkipToFirstUncheckedCandidate():
@@ -812,97 +2411,69 @@ class PrettyWidget(QtWidgets.QWidget):
 			return
 		self.lastOutputDir = outDir
 		self.SaveConfig()
-
-		
-		# write the pdfs
-		# within internal dirs, write each page to jpg and then convert to pdf		
-		shutil.rmtree(outDir)
-		os.mkdir(outDir)
-		self.progressLB.show()
-		for i in range(len(self.candidateDirs)):
-			self.progressLB.setText("Processing... (%d/%d)" % (i+1, len(self.candidateDirs)))
-			QtWidgets.QApplication.processEvents()
-			candidate_dir = self.candidateDirs[i]
-			candidate = Candidate(candidate_dir)
-			out_working_dir = os.path.join(candidate_dir,"output") 
-			if	os.path.exists(out_working_dir):
-				shutil.rmtree(out_working_dir)
-			os.mkdir(out_working_dir)
-			for j in range(len(candidate.marks)):
-				pixmap = self.CreatePixmap(QtGui.QPixmap(candidate.GetPagePath(j)), candidate.marks[j])
-				out_path = os.path.join(out_working_dir, "%03d_"%(j)+".jpg")
-				pixmap.save(out_path, "jpg")
-		
-			marked_jpgs = glob.glob(os.path.join(out_working_dir,"*"))
-			pdf = fpdf.FPDF(unit="mm", format=[210,297]) # A4 in mm
-			for image in marked_jpgs:
-				pdf.add_page()
-				pdf.set_margins(10,10,10)					
-				with Image.open(image) as im:
-					w = im.width/(2480/190) # rescale from A4 at 300 dpi
-					h = im.height/(3509/297)
-				scale = 1
-				scale = min(scale, 170/w)
-				scale = min(scale, 277/h)
-				pdf.image(image, 10, 10, int(w*scale), int(h*scale))
-			pdf.output(os.path.join(outDir, candidate.name+".pdf"), "F")
-			
-			logging.info("Wrote marked pdf for '%s' (%d/%d)" % (candidate.name, i+1, len(self.candidateDirs)))
-			shutil.rmtree(out_working_dir)
-		self.progressLB.hide()
 		
-		if not self.markScheme:
-			return
-		
-		# write the csvs
-		questions_str = ""
-		part_questions_str = ""
-		for i in range(len(self.markScheme.qs_max)):
-			questions_str += "Q" + str(i+1) + "," 
-			for label in self.markScheme.part_qs_str[i]:
-				part_questions_str += str(i+1) + label + ","
-		
-		csv_tots	= "Candidate,Total,\n"
-		csv_qs		= "Candidate, " + questions_str + "Total,\n"
-		csv_part_qs = "Candidate," + part_questions_str + "Total,\n"
-		csv_exam	= ""
-		
-		for i in range(len(self.candidateDirs)):
-			dir = self.candidateDirs[i]
-			candidate = Candidate(dir)
-			qs, part_qs = candidate.CollateMarks()
-			qs_str = ",".join(str(x) for x in qs)
-			part_qs_str = ",".join(str(x) for x in list(itertools.chain.from_iterable(part_qs)))		
-			tot_str = str(np.sum(qs, dtype=int))
-			
-			csv_tots += candidate.name + "," + tot_str + ",\n"
-			csv_qs += candidate.name + "," + qs_str + "," + tot_str + ",\n"
-			csv_part_qs += candidate.name + "," + part_qs_str + "," + tot_str + ",\n"
-			csv_exam += candidate.name + "," + tot_str + "\n"
+		dirs = list(self.catalog.dirs)
+		self.SubmitJob(Job("Output", ExportScripts, dirs, outDir, self.tabletPenSize, self.marginX if self.markScheme else None))
+		if self.markScheme:
+			self.SubmitJob(Job("Results", WriteResults, dirs, outDir, self.markScheme))
 			
-		with open(os.path.join(outDir, "out_totals.csv"), "w") as csv:
-			csv.write(csv_tots)
-		with open(os.path.join(outDir, "out_qs.csv"), "w") as csv:
-			csv.write(csv_qs)
-		with open(os.path.join(outDir, "out_part_qs.csv"), "w") as csv:
-			csv.write(csv_part_qs)
-		with open(os.path.join(outDir, "out_somas_upload_format.csv"), "w") as csv:
-			csv.write(csv_exam)
+	def RecheckCandidates(self, dirs):
+		catalog = self.catalog
+		job = Job("Recheck", RecheckCandidates, dirs, self.markScheme)
+		job.signals.status.connect(catalog.SetStatus)
+		job.signals.finished.connect(lambda ok: (catalog.SaveStatus(), self.UpdatePixmap()))
+		self.SubmitJob(job)
 		
-		logging.info("Wrote csv files, output complete")
+	def SubmitJob(self, job):
+		# jobs belong to the current scripts dir, so that changing it cancels them rather than blocking its own
+		job.inputDir = self.lastInputDir
+		return self.jobs.Submit(job)
 		
+	def UpdateJobStatus(self):
+		text = self.jobs.GetStatusText()
+		self.progressLB.setText(text)
+		self.progressLB.setVisible(bool(text))
+		self.cancelJobsButton.setVisible(bool(text))
+	
 	def resizeEvent(self, event):
+		if getattr(self, "recorder", None):
+			self.recorder.Record({"type" : "resize", "size" : [self.width(), self.height()]})
 		if hasattr(self,"curCandidate"): # can occur before __init__
 			self.UpdatePixmap()
 
 	def closeEvent(self, event):
+		if self.scriptWatcher:
+			self.scriptWatcher.Stop()
+		self.jobs.CancelAll()
+		self.jobs.Wait()
+		if self.overview:
+			self.overview.model().Wait()
+			self.overview.close()
 		if self.curCandidate:
-			self.curCandidate.SaveMarks()
+			if self.lease.held:
+				self.SaveMarks()
+			self.catalog.SaveStatus()
+			self.lease.Release()
+			if os.path.exists(self.GetSessionFile()):
+				os.remove(self.GetSessionFile())
+		if self.recorder:
+			self.recorder.Close()
 		logging.info("Shutdown")
 		
 def main():
-	app = QtWidgets.QApplication(sys.argv)
-	ex = PrettyWidget()
+	parser = argparse.ArgumentParser(description="Batch marking of pdf scripts")
+	parser.add_argument("--record", metavar="FILE", help="record the input events of this session to FILE")
+	parser.add_argument("--replay", metavar="FILE", help="replay a recorded session headlessly and report event handling latency")
+	args, qt_args = parser.parse_known_args()
+	if args.replay:
+		os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+		app = QtWidgets.QApplication(sys.argv[:1] + qt_args)
+		sys.exit(ReplaySession(args.replay))
+	app = QtWidgets.QApplication(sys.argv[:1] + qt_args)
+	recorder = EventRecorder(args.record) if args.record else None
+	ex = PrettyWidget(recorder=recorder)
+	if recorder:
+		recorder.RecordHeader(ex)
 	app.exec_()
 
 if __name__ == '__main__':